@@ -2,14 +2,28 @@
 #
 # How to communicate with worker ?
 
+import os
 import socket
 import json
+import asyncio
+import struct
+import threading
+import time
+import zlib
+import lzma
+import mmap
+import hashlib
 
 import typing
 from typing import *
 
 from datetime import datetime
 
+# Compact letter of a version that newer than COMPACT_VERSION,
+# it's not an end of stream.
+class LETTER_VERSION_NOT_SUPPORTED(Exception):
+    pass
+
 def newTaskLetterValidity(letter: 'Letter') -> bool:
     isHValid = letter.getHeader('ident') != "" and letter.getHeader('tid') != ""
     isCValid = letter.getContent('sn') != "" and \
@@ -46,8 +60,37 @@ def logRegisterLetterValidity(letter: 'Letter') -> bool:
 
     return isHValid
 
+def resumeLetterValidity(letter: 'Letter') -> bool:
+    isHValid = letter.getHeader('tid') != ""
+    isCValid = letter.getContent('offset').isdigit()
+
+    return isHValid and isCValid
+
+# Separators are the same as str() of dict so json form
+# of letters is not changed. C accelerated encoder is used
+# directly if it's available to skip JSONEncoder's overhead.
+if json.encoder.c_make_encoder is not None:
+    cJsonEncoder = json.encoder.c_make_encoder(
+        None, str, json.encoder.c_encode_basestring, None,
+        ": ", ", ", False, False, True)
+
+    def jsonEncode(o:Any) -> str:
+        return "".join(cJsonEncoder(o, 0))
+else:
+    jsonEncode = json.JSONEncoder(ensure_ascii = False, default = str).encode
+
 class Letter:
 
+    # Fields of a letter is kept in slots of it's type, header and
+    # content are materialized as dicts only if a key that is not
+    # one of the fixed fields is set or they are accessed directly.
+    __slots__ = ('type_', '_header', '_content',
+                 '__str', '__frame', '__compactFrame')
+
+    # Fixed fields of a type, key : slot
+    HEADER_FIELDS = {} # type: Dict[str, str]
+    CONTENT_FIELDS = {} # type: Dict[str, str]
+
     # Format of NewTask letter
     # Type    : 'new'
     # header  : '{"tid":"...", "parent":"...", "needPost":"true/false", "menu":"..."}'
@@ -90,17 +133,17 @@ class Letter:
 
     # Format of PrpertyNotify letter
     # Type    : 'notify'
-    # header  : '{"ident":"..."}'
+    # header  : '{"ident":"...", "compact":"..."}'
     # content : '{"MAX":"...", "PROC":"..."}'
     PropertyNotify = 'notify'
 
     # Format of binary letter in a stream
     # | Type (2Bytes) 00001 :: Int | Length (4Bytes) :: Int | Ext (10 Bytes)
-    # | TaskId (64Bytes) :: String | Parent (30 Bytes) :: String
+    # | TaskId (64Bytes) :: String | Parent (64 Bytes) :: String
     # | Menu (30 Bytes) :: String | Content |
     # Format of BinaryFile letter
     # Type    : 'binary'
-    # header  : '{"tid":"...", "parent":"..."}'
+    # header  : '{"tid":"...", "parent":"...", "last":"true/false"}'
     # content : "{"bytes":b"..."}"
     BinaryFile = 'binary'
 
@@ -116,44 +159,204 @@ class Letter:
     # content : "{}"
     LogRegister = 'logRegister'
 
+    # Format of Resume letter, receiver of a file tell the
+    # sender the offset of the file to continue with.
+    # Type    : 'resume'
+    # header  : '{"tid":"...", "parent":"..."}'
+    # content : '{"offset":"..."}'
+    Resume = 'resume'
+
+    # Format of Batch letter in a stream
+    # | Type (2Bytes) 00006 :: Int | Length (4Bytes) :: Int | Letters |
+    # Letters is a sequence of frames of any other kind of letter.
+    # Format of Batch letter
+    # Type    : 'batch'
+    # header  : '{}'
+    # content : '{"frames":b"..."}'
+    Batch = 'batch'
+
     BINARY_HEADER_LEN = 174
     BINARY_MIN_HEADER_LEN = 6
 
+    # Type field of binary letters, a binary letter with type
+    # BINARY_LAST_CODE is the last chunk of a file.
+    #
+    # Header of BINARY_LAST_DIGEST_CODE is followed by sha256
+    # digest of the whole file.
+    BINARY_CODE = 1
+    BINARY_LAST_CODE = 2
+    BINARY_LAST_DIGEST_CODE = 7
+    BINARY_DIGEST_LEN = 32
+    BINARY_MAX_HEADER_LEN = BINARY_HEADER_LEN + BINARY_DIGEST_LEN
+
+    # Compression of content of binary letters and compact letters.
+    # Id of the method is kept in bits above COMPRESS_SHIFT of type
+    # field of binary letters and in flags field of compact letters.
+    COMPRESS_NONE = "none"
+    COMPRESS_ZLIB = "zlib"
+    COMPRESS_LZMA = "lzma"
+    # Compress with zlib only if content is likely compressible
+    COMPRESS_AUTO = "auto"
+    COMPRESS_SHIFT = 3
+
+    # Binary codes with every compress method
+    BINARY_CODES = (1, 2, 7, 9, 10, 15, 17, 18, 23)
+
+    # Format of compact letter in a stream
+    # | Type (2Bytes) :: Int | Version (1Byte) :: Int | Flags (1Byte) :: Int
+    # | Length (4Bytes) :: Int | Fields |
+    #
+    # Fields of a type are listed in compactFormats, every field
+    # except the last one is prefixed with it's length (2Bytes),
+    # the last one take the rest of the letter. Flags is reserved.
+    #
+    # Compact letters are sent only to peers that advertise
+    # a compact version via PropertyNotify letter.
+    COMPACT_VERSION = 1
+    COMPACT_HEADER = struct.Struct(">HBBI")
+    COMPACT_HEADER_LEN = 8
+    COMPACT_RESPONSE_CODE = 3
+    COMPACT_NOTIFY_CODE = 4
+    COMPACT_LOG_CODE = 5
+    COMPACT_CODES = (COMPACT_RESPONSE_CODE, COMPACT_NOTIFY_CODE, COMPACT_LOG_CODE)
+
+    BATCH_CODE = 6
+    BATCH_HEADER_LEN = 6
+
     MAX_LEN = 512
 
     format = '{"type":"%s", "header":%s, "content":%s}'
 
+    # Format of each type with type field filled
+    typedFormat = '{"type":%s, "header":%%s, "content":%%s}'
+    formats = {} # type: Dict[str, str]
+
     def __init__(self, type_: str,
-                 header: Dict[str, str] = {},
-                 content: Dict[str, Any] = {}) -> None:
+                 header: Optional[Dict[str, str]] = None,
+                 content: Optional[Dict[str, Any]] = None) -> None:
 
         self.type_ = type_
 
-        # header field is a dictionary
-        self.header = header
+        # header field is a dictionary, None means that
+        # it's not materialized from the fixed fields yet.
+        self._header = header
 
         # content field is a dictionary
-        self.content = content
+        self._content = content
+
+        # Serialized letter, invalidated by modification
+        # via setHeader() and setContent()
+        self.__str = None # type: Optional[str]
+        self.__frame = None # type: Optional[bytes]
+        self.__compactFrame = None # type: Optional[Tuple[int, bytes]]
 
         #if not self.validity():
         #    print(self.type_ + str(self.header) + str(self.content))
 
     # Generate a json string
     def toString(self) -> str:
-        # length of content after length
-        headerStr = str(self.header).replace("'", "\"")
-        contentStr = str(self.content).replace("'", "\"")
-        return Letter.format % (self.type_, headerStr, contentStr)
+        if self.__str is not None:
+            return self.__str
+
+        format = Letter.formats.get(self.type_)
+        if format is None:
+            format = Letter.typedFormat % jsonEncode(self.type_)
+            Letter.formats[self.type_] = format
+
+        self.__str = format % (
+            jsonEncode(self.__fieldsOf(self._header, self.HEADER_FIELDS)),
+            jsonEncode(self.__fieldsOf(self._content, self.CONTENT_FIELDS)))
+
+        return self.__str
 
     def toJson(self) -> Dict:
-        jsonStr = self.toString()
-        return json.loads(jsonStr)
+        return {"type":self.type_,
+                "header":dict(self.__fieldsOf(self._header, self.HEADER_FIELDS)),
+                "content":dict(self.__fieldsOf(self._content, self.CONTENT_FIELDS))}
+
+    @property
+    def header(self) -> Dict[str, Any]:
+        if self._header is None:
+            self._header = self.__fieldsOf(None, self.HEADER_FIELDS)
+        return self._header
+
+    @header.setter
+    def header(self, header:Dict[str, Any]) -> None:
+        self._header = header
+        self.invalidate()
+
+    @property
+    def content(self) -> Dict[str, Any]:
+        if self._content is None:
+            self._content = self.__fieldsOf(None, self.CONTENT_FIELDS)
+        return self._content
+
+    @content.setter
+    def content(self, content:Dict[str, Any]) -> None:
+        self._content = content
+        self.invalidate()
+
+    # Materialized dict or a new dict of fixed fields
+    def __fieldsOf(self, dict_:Optional[Dict[str, Any]],
+                   fields:Dict[str, str]) -> Dict[str, Any]:
+        if dict_ is not None:
+            return dict_
+
+        return {key:getattr(self, slot) for (key, slot) in fields.items()}
 
     def toBytesWithLength(self) -> bytes:
-        str = self.toString()
-        bStr = str.encode()
+        if self.__frame is None:
+            bStr = self.toString().encode()
+            self.__frame = len(bStr).to_bytes(2, "big") + bStr
+
+        return self.__frame
+
+    # Drop serialized letter after modification
+    def invalidate(self) -> None:
+        self.__str = None
+        self.__frame = None
+        self.__compactFrame = None
+
+    # Generate compact form of the letter for a peer that support
+    # compact letters of version, letters without compact form and
+    # letters to peers that not support it are in json form.
+    def toCompactBytes(self, version:int = COMPACT_VERSION,
+                       compress:str = COMPRESS_NONE) -> bytes:
+        if version < 1 or self.type_ not in compactFormats:
+            return self.toBytesWithLength()
+
+        if self.__compactFrame is not None and \
+           self.__compactFrame[0] == (version, compress):
+            return self.__compactFrame[1]
+
+        (code, fields) = compactFormats[self.type_]
+
+        values = [
+            str(self.getHeader(key) if part == "header" else self.getContent(key)).encode()
+            for (part, key) in fields
+        ]
+
+        parts = []
+        for value in values[:-1]:
+            parts.append(len(value).to_bytes(2, "big"))
+            parts.append(value)
+
+        # Last field is not prefixed by length
+        parts.append(values[-1])
+        body = b"".join(parts)
 
-        return len(bStr).to_bytes(2, "big") + bStr
+        (compressId, body) = compressContent(body, compress)
+
+        frame = Letter.COMPACT_HEADER.pack(code, version, compressId, len(body)) + body
+        self.__compactFrame = ((version, compress), frame)
+
+        return frame
+
+    # Compact version to talk with a peer which
+    # support compact letters of peerVersion.
+    @staticmethod
+    def compactVersionWith(peerVersion:int) -> int:
+        return min(peerVersion, Letter.COMPACT_VERSION)
 
     @staticmethod
     def json2Letter(s: str) -> 'Letter':
@@ -168,28 +371,44 @@ class Letter:
         return self.type_
 
     def getHeader(self, key: str) -> str:
-        if key in self.header:
-            return self.header[key]
-        else:
-            return ""
+        header = self._header
+
+        if header is None:
+            slot = self.HEADER_FIELDS.get(key)
+            return "" if slot is None else getattr(self, slot)
+
+        return header.get(key, "")
 
     def addToHeader(self, key: str, value: str) -> None:
-        self.header[key] = value
+        self.setHeader(key, value)
 
     def setHeader(self, key:str, value:str) -> None:
-        self.header[key] = value
+        if self._header is None and key in self.HEADER_FIELDS:
+            setattr(self, self.HEADER_FIELDS[key], value)
+        else:
+            self.header[key] = value
+
+        self.invalidate()
 
     def setContent(self, key:str, value:Union[str, bytes]) -> None:
-        self.content[key] = value
+        if self._content is None and key in self.CONTENT_FIELDS:
+            setattr(self, self.CONTENT_FIELDS[key], value)
+        else:
+            self.content[key] = value
+
+        self.invalidate()
 
     def addToContent(self, key: str, value: str) -> None:
-        self.content[key] = value
+        self.setContent(key, value)
 
     def getContent(self, key: str) -> Any:
-        if key in self.content:
-            return self.content[key]
-        else:
-            return ""
+        content = self._content
+
+        if content is None:
+            slot = self.CONTENT_FIELDS.get(key)
+            return "" if slot is None else getattr(self, slot)
+
+        return content.get(key, "")
 
     # If a letter is received completely return 0 otherwise return the remaining bytes
     @staticmethod
@@ -198,12 +417,44 @@ class Letter:
         if len(s) < Letter.BINARY_MIN_HEADER_LEN:
             return Letter.MAX_LEN
 
-        if int.from_bytes(s[:2], "big") == 1:
-            length = int.from_bytes(s[2:6], "big")
-            return length - (len(s) - Letter.BINARY_HEADER_LEN)
+        headerLen = Letter.frameHeaderLen(s)
+
+        # Length field of compact letter is not received yet
+        if len(s) < Letter.COMPACT_HEADER_LEN and \
+           headerLen == Letter.COMPACT_HEADER_LEN:
+            return Letter.MAX_LEN
+
+        return Letter.frameContentLen(s) - (len(s) - headerLen)
+
+    # Length of header of the frame begin with s,
+    # s should contain at least 2 bytes.
+    @staticmethod
+    def frameHeaderLen(s: bytes) -> int:
+        code = int.from_bytes(s[:2], "big")
+
+        if code in Letter.BINARY_CODES:
+            if code & ((1 << Letter.COMPRESS_SHIFT) - 1) == Letter.BINARY_LAST_DIGEST_CODE:
+                return Letter.BINARY_MAX_HEADER_LEN
+            return Letter.BINARY_HEADER_LEN
+        elif code in Letter.COMPACT_CODES:
+            return Letter.COMPACT_HEADER_LEN
+        elif code == Letter.BATCH_CODE:
+            return Letter.BATCH_HEADER_LEN
         else:
-            length = int.from_bytes(s[:2], "big")
-            return length - (len(s) - 2)
+            return 2
+
+    # Length of content of the frame begin with s,
+    # s should contain the whole header of the frame.
+    @staticmethod
+    def frameContentLen(s: bytes) -> int:
+        code = int.from_bytes(s[:2], "big")
+
+        if code in Letter.BINARY_CODES or code == Letter.BATCH_CODE:
+            return int.from_bytes(s[2:6], "big")
+        elif code in Letter.COMPACT_CODES:
+            return int.from_bytes(s[4:8], "big")
+        else:
+            return code
 
     @staticmethod
     def parse(s : bytes) -> Optional['Letter']:
@@ -211,20 +462,64 @@ class Letter:
         if len(s) < Letter.BINARY_MIN_HEADER_LEN:
             return None
 
+        code = int.from_bytes(s[:2], "big")
+
         # To check that is BinaryFile type or another
-        if int.from_bytes(s[:2], "big") == 1:
+        if code in Letter.BINARY_CODES:
             return BinaryLetter.parse(s)
+        elif code in Letter.COMPACT_CODES:
+            return Letter.__parseCompact(s)
+        elif code == Letter.BATCH_CODE:
+            return BatchLetter.parse(s)
         else:
             return Letter.__parse(s)
 
+    # Decode the frame only once then build the typed
+    # letter from the parsed dict directly.
     @staticmethod
     def __parse(s: bytes) -> Optional['Letter']:
-        letter = s[2:].decode()
-        dict_ = json.loads(letter)
+        dict_ = json.loads(bytes(s[2:]))
 
         type_ = dict_['type']
 
-        return parseMethods[type_].parse(s)
+        return parseMethods[type_].fromDict(dict_['header'], dict_['content'])
+
+    @staticmethod
+    def __parseCompact(s: bytes) -> 'Letter':
+        (code, version, compressId, length) = Letter.COMPACT_HEADER.unpack_from(s)
+
+        if version > Letter.COMPACT_VERSION:
+            raise LETTER_VERSION_NOT_SUPPORTED(version)
+
+        type_ = compactTypes[code]
+        (_, fields) = compactFormats[type_]
+
+        header = {} # type: Dict[str, str]
+        content = {} # type: Dict[str, str]
+
+        pos = Letter.COMPACT_HEADER_LEN
+        end = pos + length
+
+        if compressId != 0:
+            s = decompressContent(s[pos:end], compressId)
+            pos, end = 0, len(s)
+
+        for (idx, (part, key)) in enumerate(fields):
+            if idx == len(fields) - 1:
+                size = end - pos
+            else:
+                size = int.from_bytes(s[pos:pos+2], "big")
+                pos += 2
+
+            value = bytes(s[pos:pos+size]).decode()
+            pos += size
+
+            if part == "header":
+                header[key] = value
+            else:
+                content[key] = value
+
+        return parseMethods[type_].fromDict(header, content)
 
     def validity(self) -> bool:
         type = self.typeOfLetter()
@@ -232,15 +527,95 @@ class Letter:
 
     # PropertyNotify letter interface
     def propNotify_MAX(self) -> int:
-        return int(self.content['MAX'])
+        return int(self.getContent('MAX'))
     def propNotify_PROC(self) -> int:
-        return int(self.content['PROC'])
+        return int(self.getContent('PROC'))
     def propNotify_IDENT(self) -> str:
-        return self.header['ident']
+        return self.getHeader('ident')
+    def propNotify_COMPACT(self) -> int:
+        compact = self.getHeader('compact')
+        return int(compact) if compact != "" else 0
+
+# Id of compress methods on the wire
+compressIds = {
+    Letter.COMPRESS_NONE :0,
+    Letter.COMPRESS_ZLIB :1,
+    Letter.COMPRESS_LZMA :2
+} # type: Dict[str, int]
+
+compressNames = {
+    id_:name for (name, id_) in compressIds.items()
+} # type: Dict[int, str]
+
+ZLIB_LEVEL = 1
+
+# Content smaller than this is not compressed
+COMPRESS_MIN_LEN = 256
+
+# Sample that used by COMPRESS_AUTO to guess
+# whether content is compressible.
+COMPRESS_SAMPLE_LEN = 64 * 1024
+COMPRESS_MIN_RATIO = 0.9
+
+# Compressed content that expand beyond this is rejected
+DECOMPRESS_MAX_LEN = 64 * 1024 * 1024
+
+# Extensions of files that are compressed already
+compressedExtensions = {
+    "zip", "gz", "tgz", "bz2", "xz", "lzma", "7z", "zst", "rar",
+    "jar", "war", "whl", "deb", "rpm", "apk",
+    "jpg", "jpeg", "png", "gif", "mp3", "mp4", "mkv"
+}
+
+# Compress content by method, return id of the method that
+# actually used and the content. Content is not compressed
+# if it's not get smaller.
+def compressContent(content:Any, method:str, extension:str = "") -> Tuple[int, Any]:
+    if method == Letter.COMPRESS_NONE or len(content) < COMPRESS_MIN_LEN:
+        return (0, content)
+
+    if method == Letter.COMPRESS_AUTO:
+        if extension.lower() in compressedExtensions:
+            return (0, content)
+
+        sample = content[:COMPRESS_SAMPLE_LEN]
+        if len(zlib.compress(sample, 1)) > len(sample) * COMPRESS_MIN_RATIO:
+            return (0, content)
+
+        method = Letter.COMPRESS_ZLIB
+
+    if method == Letter.COMPRESS_ZLIB:
+        compressed = zlib.compress(content, ZLIB_LEVEL)
+    else:
+        compressed = lzma.compress(content)
+
+    if len(compressed) >= len(content):
+        return (0, content)
+
+    return (compressIds[method], compressed)
+
+# Content is decompressed incrementally up to maxLen
+# so a small frame can't be expanded without limit.
+def decompressContent(content:Any, compressId:int,
+                      maxLen:int = DECOMPRESS_MAX_LEN) -> bytes:
+    if compressId == compressIds[Letter.COMPRESS_ZLIB]:
+        d = zlib.decompressobj() # type: Any
+    elif compressId == compressIds[Letter.COMPRESS_LZMA]:
+        d = lzma.LZMADecompressor()
+    else:
+        raise ValueError("Unknown compress method: %d" % compressId)
+
+    decompressed = d.decompress(content, maxLen + 1)
+
+    if len(decompressed) > maxLen:
+        raise ValueError("Decompressed content exceed %d bytes" % maxLen)
+    if not d.eof:
+        raise ValueError("Compressed content is incomplete")
+
+    return decompressed
 
 def bytesDivide(s:bytes) -> Tuple:
-    letter = s[2:].decode()
-    dict_ = json.loads(letter)
+    dict_ = json.loads(s[2:])
 
     type_ = dict_['type']
     header = dict_['header']
@@ -248,20 +623,54 @@ def bytesDivide(s:bytes) -> Tuple:
 
     return (type_, header, content)
 
+# Send all of buffers to sock, use sendmsg
+# to avoid join buffers if it's supported.
+def sendBuffers(sock:socket.socket, buffers:List) -> None:
+    views = [memoryview(b).cast("B") for b in buffers if len(b) > 0]
+
+    if not hasattr(sock, "sendmsg"):
+        for v in views:
+            sock.sendall(v)
+        return None
+
+    while len(views) > 0:
+        sent = sock.sendmsg(views)
+
+        while sent > 0:
+            if sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
 class NewLetter(Letter):
 
+    __slots__ = ('_tid', '_parent', '_needPost', '_menu',
+                 '_sn', '_vsn', '_datetime', '_extra')
+
+    HEADER_FIELDS = {"tid":"_tid", "parent":"_parent",
+                     "needPost":"_needPost", "menu":"_menu"}
+    CONTENT_FIELDS = {"sn":"_sn", "vsn":"_vsn",
+                      "datetime":"_datetime", "extra":"_extra"}
+
     def __init__(self, tid:str, sn:str,
                  vsn:str, datetime:str,
                  menu:str = "",
                  parent:str = "",
-                 extra:Dict = {},
+                 extra:Optional[Dict] = None,
                  needPost:str = "") -> None:
-        Letter.__init__(
-            self,
-            Letter.NewTask,
-            {"tid":tid, "parent":parent, "needPost":needPost, "menu":menu},
-            {"sn":sn, "vsn":vsn, "datetime":datetime, "extra":extra}
-        )
+        Letter.__init__(self, Letter.NewTask)
+
+        self._tid = tid
+        self._parent = parent
+        self._needPost = needPost
+        self._menu = menu
+
+        self._sn = sn
+        self._vsn = vsn
+        self._datetime = datetime
+        self._extra = {} if extra is None else extra
 
     @staticmethod
     def parse(s:bytes) -> Optional['NewLetter']:
@@ -271,6 +680,10 @@ class NewLetter(Letter):
         if type_ != Letter.NewTask:
             return None
 
+        return NewLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'NewLetter':
         return NewLetter(
             tid = header['tid'],
             sn = content['sn'],
@@ -293,10 +706,20 @@ class CommandLetter(Letter):
     COMMAND_WRONG = 3 # type: CmdType
 
 
-    def __init__(self, type:str, target:str, extra:str, content:Dict[str, str] = {}) -> None:
-        Letter.__init__(self, Letter.Command,
-                        {"type":type, "target":target, "extra":extra},
-                        {"content":content})
+    __slots__ = ('_type', '_target', '_extra', '_cmdContent')
+
+    HEADER_FIELDS = {"type":"_type", "target":"_target", "extra":"_extra"}
+    CONTENT_FIELDS = {"content":"_cmdContent"}
+
+    def __init__(self, type:str, target:str, extra:str,
+                 content:Optional[Dict[str, str]] = None) -> None:
+        Letter.__init__(self, Letter.Command)
+
+        self._type = type
+        self._target = target
+        self._extra = extra
+
+        self._cmdContent = {} if content is None else content
 
     @staticmethod
     def parse(s:bytes) -> Optional['CommandLetter']:
@@ -305,6 +728,10 @@ class CommandLetter(Letter):
         if type_ != Letter.Command:
             return None
 
+        return CommandLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'CommandLetter':
         return CommandLetter(header['type'], header['target'], header['extra'], content['content'])
 
     def cmdType(self) -> CmdType:
@@ -331,9 +758,20 @@ class CommandLetter(Letter):
 
 class MenuLetter(Letter):
 
+    __slots__ = ('_mid', '_version', '_cmds', '_depends', '_output')
+
+    HEADER_FIELDS = {"mid":"_mid", "version":"_version"}
+    CONTENT_FIELDS = {"cmds":"_cmds", "depends":"_depends", "output":"_output"}
+
     def __init__(self, ver:str, mid:str, cmds:List[str], depends:List[str], output:str) -> None:
-        Letter.__init__(self, Letter.NewMenu, {"mid":mid, "version":ver},
-                        {"cmds":cmds, "depends":depends, "output":output})
+        Letter.__init__(self, Letter.NewMenu)
+
+        self._mid = mid
+        self._version = ver
+
+        self._cmds = cmds
+        self._depends = depends
+        self._output = output
 
     @staticmethod
     def parse(s:bytes) -> Optional['MenuLetter']:
@@ -342,19 +780,28 @@ class MenuLetter(Letter):
         if type_ != Letter.NewMenu:
             return None
 
+        return MenuLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'MenuLetter':
         return MenuLetter(header['version'], header['mid'], content['cmds'], content['depends'], content['output'])
 
 
 
 class ResponseLetter(Letter):
 
+    __slots__ = ('_tid', '_parent', '_state')
+
+    HEADER_FIELDS = {"tid":"_tid", "parent":"_parent"}
+    CONTENT_FIELDS = {"state":"_state"}
+
     def __init__(self, tid:str, state:str, parent:str = "") -> None:
-        Letter.__init__(
-            self,
-            Letter.Response,
-            {"tid":tid, "parent":parent},
-            {"state":state}
-        )
+        Letter.__init__(self, Letter.Response)
+
+        self._tid = tid
+        self._parent = parent
+
+        self._state = state
 
     @staticmethod
     def parse(s:bytes) -> Optional['ResponseLetter']:
@@ -363,6 +810,10 @@ class ResponseLetter(Letter):
         if type_ != Letter.Response:
             return None
 
+        return ResponseLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'ResponseLetter':
         return ResponseLetter(
             tid = header['tid'],
             state = content['state'],
@@ -371,13 +822,20 @@ class ResponseLetter(Letter):
 
 class PropLetter(Letter):
 
-    def __init__(self, ident:str, max:str, proc:str) -> None:
-        Letter.__init__(
-            self,
-            Letter.PropertyNotify,
-            {"ident":ident},
-            {"MAX":max, "PROC":proc}
-        )
+    __slots__ = ('_ident', '_compact', '_max', '_proc')
+
+    HEADER_FIELDS = {"ident":"_ident", "compact":"_compact"}
+    CONTENT_FIELDS = {"MAX":"_max", "PROC":"_proc"}
+
+    def __init__(self, ident:str, max:str, proc:str,
+                 compact:str = str(Letter.COMPACT_VERSION)) -> None:
+        Letter.__init__(self, Letter.PropertyNotify)
+
+        self._ident = ident
+        self._compact = compact
+
+        self._max = max
+        self._proc = proc
 
     @staticmethod
     def parse(s:bytes) -> Optional['PropLetter']:
@@ -386,34 +844,117 @@ class PropLetter(Letter):
         if type_ != Letter.PropertyNotify:
             return None
 
+        return PropLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'PropLetter':
         return PropLetter(
             ident = header['ident'],
             max = content['MAX'],
-            proc = content['PROC']
+            proc = content['PROC'],
+            compact = header.get('compact', "0")
         )
 
 class BinaryLetter(Letter):
 
+    # | Type (2Bytes) 00001 :: Int | Length (4Bytes) :: Int | Ext (10 Bytes) | TaskId (64Bytes) :: String
+    # | Parent(64 Bytes) :: String | Menu (30 Bytes) :: String |
+    HEADER = struct.Struct(">HI10s64s64s30s")
+
+    # Size of chunks that generated by chunksOf()
+    CHUNK_SIZE = 1024 * 1024
+
+    __slots__ = ('_tid', '_extension', '_parent', '_menu', '_last',
+                 '_compress', '_digest', '_bytes')
+
+    HEADER_FIELDS = {"tid":"_tid", "extension":"_extension", "parent":"_parent",
+                     "menu":"_menu", "last":"_last", "compress":"_compress",
+                     "digest":"_digest"}
+    CONTENT_FIELDS = {"bytes":"_bytes"}
+
+    # Content is compressed by compress method while the letter is
+    # packed, received letters are decompressed already and compress
+    # field of them is the method that used during transfer.
+    #
+    # digest is hex of sha256 of the whole file, it's sent only
+    # with the last chunk.
     def __init__(self, tid:str, bStr:bytes, menu:str = "",
                  extension:str = "", parent:str = "",
-                 last:str = "false") -> None:
+                 last:str = "false",
+                 compress:str = Letter.COMPRESS_NONE,
+                 digest:str = "") -> None:
 
-        Letter.__init__(
-            self,
-            Letter.BinaryFile,
-            {"tid":tid, "extension":extension, "parent":parent, "menu":menu},
-            {"bytes":bStr}
-        )
+        Letter.__init__(self, Letter.BinaryFile)
+
+        self._tid = tid
+        self._extension = extension
+        self._parent = parent
+        self._menu = menu
+        self._last = last
+        self._compress = compress
+        self._digest = digest
+
+        self._bytes = bStr
+
+    def isLast(self) -> bool:
+        return self.getHeader('last') == "true"
+
+    def headerLen(self) -> int:
+        if self.isLast() and self.getHeader('digest') != "":
+            return Letter.BINARY_MAX_HEADER_LEN
+
+        return Letter.BINARY_HEADER_LEN
+
+    # Whether content that stored into chooser is the file that
+    # digest of the letter is come from, chooser's digest is
+    # used so the file is not read again.
+    def verify(self, chooser:Any) -> bool:
+        digest = self.getHeader('digest')
 
+        if digest == "":
+            return True
+
+        stored = chooser.digest()
+
+        # Chooser that not hash it's whole content
+        if stored is None:
+            stored = hashlib.sha256(chooser.view()).hexdigest()
+
+        return stored == digest
+
+    # Content of the letter is a memoryview over s
+    # instead of a copy.
     @staticmethod
     def parse(s:bytes) -> Optional['BinaryLetter']:
-        extension = s[6:16].decode().replace(" ", "")
-        tid = s[16:80].decode().replace(" ", "")
-        parent = s[80:144].decode().replace(" ", "")
-        menu = s[144:174].decode().replace(" ", "")
-        content = s[174:]
+        content = memoryview(s)[Letter.frameHeaderLen(s):]
+
+        return BinaryLetter.fromHeader(s, content)
+
+    # Build a BinaryLetter from a binary header and
+    # a content that is received separately.
+    @staticmethod
+    def fromHeader(header:bytes, content:bytes) -> 'BinaryLetter':
+        (code, _, extension, tid, parent, menu) = BinaryLetter.HEADER.unpack_from(header)
+
+        compressId = code >> Letter.COMPRESS_SHIFT
+        code = code & ((1 << Letter.COMPRESS_SHIFT) - 1)
+
+        if compressId != 0:
+            content = decompressContent(content, compressId)
+
+        digest = ""
+        if code == Letter.BINARY_LAST_DIGEST_CODE:
+            digest = bytes(header[Letter.BINARY_HEADER_LEN:Letter.BINARY_MAX_HEADER_LEN]).hex()
 
-        return BinaryLetter(tid, content, menu, extension, parent = parent)
+        return BinaryLetter(
+            tid.decode().replace(" ", ""),
+            content,
+            menu.decode().replace(" ", ""),
+            extension.decode().replace(" ", ""),
+            parent = parent.decode().replace(" ", ""),
+            last = "false" if code == Letter.BINARY_CODE else "true",
+            compress = compressNames[compressId],
+            digest = digest)
 
     def toBytesWithLength(self) -> bytes:
 
@@ -425,43 +966,184 @@ class BinaryLetter(Letter):
         return bStr
 
     def binaryPack(self) -> Optional[bytes]:
-        tid = self.getHeader('tid')
-        extension = self.getHeader('extension')
+        buffers = self.toBuffers()
+
+        if buffers is None:
+            return None
+
+        return b"".join(buffers)
+
+    # Header and content of the letter without joining them,
+    # None if content of the letter is not bytes.
+    def toBuffers(self) -> Optional[List[Union[bytes, bytearray, memoryview]]]:
         content = self.getContent("bytes")
-        parent = self.getHeader('parent')
-        menu = self.getHeader('menu')
 
         if type(content) is str:
             return None
 
-        tid_field = b"".join([" ".encode() for x in range(64 - len(tid))]) + tid.encode()
-        parent_field = b"".join([" ".encode() for x in range(64 - len(parent))]) + parent.encode()
-        ext_field = b"".join([" ".encode() for x in range(10 - len(extension))]) + extension.encode()
-        menu_field = b"".join([" ".encode() for x in range(30 - len(menu))]) + menu.encode()
+        (compressId, content) = compressContent(
+            content, self.getHeader('compress'), self.getHeader('extension'))
+
+        header = bytearray(self.headerLen())
+        self.packHeaderInto(header, len(content), compressId = compressId)
 
-        # Safe here content must not str and must a bytes
-        # | Type (2Bytes) 00001 :: Int | Length (4Bytes) :: Int | Ext (10 Bytes) | TaskId (64Bytes) :: String
-        # | Parent(64 Bytes) :: String | Menu (30 Bytes) :: String | Content :: Bytes |
-        packet = (1).to_bytes(2, "big") + \
-                 (len(content)).to_bytes(4, "big") + \
-                 ext_field + \
-                 tid_field + \
-                 parent_field + \
-                 menu_field + \
-                 content
+        return [header, content]
 
-        return packet
+    # Write header of the letter into buffer at offset, length
+    # field is set to the length of the content if not specified.
+    def packHeaderInto(self, buffer:Union[bytearray, memoryview],
+                       length:Optional[int] = None, offset:int = 0,
+                       compressId:int = 0) -> None:
+
+        if length is None:
+            length = len(self.getContent("bytes"))
+
+        digest = self.getHeader('digest')
+
+        if self.isLast() and digest != "":
+            code = Letter.BINARY_LAST_DIGEST_CODE
+        elif self.isLast():
+            code = Letter.BINARY_LAST_CODE
+        else:
+            code = Letter.BINARY_CODE
+
+        code |= compressId << Letter.COMPRESS_SHIFT
+
+        BinaryLetter.HEADER.pack_into(
+            buffer, offset, code, length,
+            self.getHeader('extension').encode().rjust(10),
+            self.getHeader('tid').encode().rjust(64),
+            self.getHeader('parent').encode().rjust(64),
+            self.getHeader('menu').encode().rjust(30))
+
+        if code & ((1 << Letter.COMPRESS_SHIFT) - 1) == Letter.BINARY_LAST_DIGEST_CODE:
+            start = offset + Letter.BINARY_HEADER_LEN
+            buffer[start:start+Letter.BINARY_DIGEST_LEN] = bytes.fromhex(digest)
+
+    # Split a file into BinaryLetters with content of chunkSize
+    # bytes, the last one is marked as last even it's empty.
+    # source is path of the file or a StoChooser.
+    #
+    # Contents of letters are views of a read only map of
+    # the file so bytes of the file are never copied.
+    #
+    # With digest, sha256 of chunks is computed while they
+    # are generated and it's sent with the last chunk.
+    #
+    # Chunks begin at offset of the file to resume a transfer.
+    @staticmethod
+    def chunksOf(tid:str, source:Any, chunkSize:int = CHUNK_SIZE,
+                 menu:str = "", extension:str = "", parent:str = "",
+                 compress:str = Letter.COMPRESS_NONE,
+                 digest:bool = False, offset:int = 0) -> Generator['BinaryLetter', None, None]:
+
+        if isinstance(source, str):
+            content = BinaryLetter.__mapFile(source)
+        else:
+            content = source.view()
+
+        size = len(content)
+        offset = min(offset, size)
+
+        h = hashlib.sha256() if digest else None
+
+        # Digest is of the whole file
+        if h is not None:
+            h.update(content[:offset])
+
+        while True:
+            chunk = content[offset:offset+chunkSize]
+            offset += len(chunk)
+            last = "true" if offset >= size else "false"
+
+            hexDigest = ""
+            if h is not None:
+                h.update(chunk)
+                if last == "true":
+                    hexDigest = h.hexdigest()
+
+            yield BinaryLetter(tid, chunk, menu, extension,
+                               parent = parent, last = last,
+                               compress = compress, digest = hexDigest)
+
+            if last == "true":
+                break
+
+    @staticmethod
+    def __mapFile(path:str) -> memoryview:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+
+            if size == 0:
+                return memoryview(b"")
+
+            # The map is valid after the file is closed
+            return memoryview(mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ))
+
+    # Append content of the letter to chooser or write it at
+    # offset of chooser, return True if it's the last chunk.
+    def storeTo(self, chooser:Any, offset:Optional[int] = None) -> bool:
+        content = self.getContent("bytes")
+
+        if len(content) > 0:
+            if offset is None:
+                chooser.store(content)
+            else:
+                chooser.storeAt(offset, content)
+
+        return self.isLast()
+
+    # Send the letter by scatter-gather io so
+    # content is not copied into a new packet.
+    def sendTo(self, sock:socket.socket) -> None:
+        buffers = self.toBuffers()
+
+        if buffers is None:
+            return None
+
+        sendBuffers(sock, buffers)
+
+    # Send count bytes of file from offset as content of a
+    # BinaryLetter, bytes of the file is sent by sendfile.
+    @staticmethod
+    def sendFileTo(sock:socket.socket, f:Any, tid:str,
+                   offset:int = 0, count:Optional[int] = None, menu:str = "",
+                   extension:str = "", parent:str = "", last:str = "false",
+                   digest:str = "") -> None:
+
+        # f is a file object or a StoChooser
+        if hasattr(f, "view"):
+            f = f.fd()
+            f.flush()
+
+        if count is None:
+            count = os.fstat(f.fileno()).st_size - offset
+
+        letter = BinaryLetter(tid, b"", menu, extension, parent = parent, last = last,
+                              digest = digest)
+
+        header = bytearray(letter.headerLen())
+        letter.packHeaderInto(header, count)
+
+        sock.sendall(header)
+        if count > 0:
+            sock.sendfile(f, offset, count)
 
 
 class LogLetter(Letter):
 
+    __slots__ = ('_ident', '_logId', '_logMsg')
+
+    HEADER_FIELDS = {"ident":"_ident", "logId":"_logId"}
+    CONTENT_FIELDS = {"logMsg":"_logMsg"}
+
     def __init__(self, ident:str, logId:str, logMsg:str) -> None:
-        Letter.__init__(
-            self,
-            Letter.Log,
-            {"ident":ident, "logId":logId},
-            {"logMsg":logMsg}
-        )
+        Letter.__init__(self, Letter.Log)
+
+        self._ident = ident
+        self._logId = logId
+
+        self._logMsg = logMsg
 
     @staticmethod
     def parse(s:bytes) -> Optional['LogLetter']:
@@ -470,6 +1152,10 @@ class LogLetter(Letter):
         if type_ != Letter.Log:
             return None
 
+        return LogLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'LogLetter':
         return LogLetter(
             ident = header['ident'],
             logId = header['logId'],
@@ -478,12 +1164,15 @@ class LogLetter(Letter):
 
 class LogRegLetter(Letter):
 
+    __slots__ = ('_ident', '_logId')
+
+    HEADER_FIELDS = {"ident":"_ident", "logId":"_logId"}
+
     def __init__(self, ident:str, logId:str) -> None:
-        Letter.__init__(
-            self,
-            Letter.LogRegister,
-            {"ident":ident, "logId":logId},
-        )
+        Letter.__init__(self, Letter.LogRegister)
+
+        self._ident = ident
+        self._logId = logId
 
     @staticmethod
     def parse(s:bytes) -> Optional['LogRegLetter']:
@@ -492,11 +1181,92 @@ class LogRegLetter(Letter):
         if  type_ != Letter.LogRegister:
             return None
 
+        return LogRegLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'LogRegLetter':
         return LogRegLetter(
             ident = header['ident'],
             logId = header['logId']
         )
 
+class ResumeLetter(Letter):
+
+    __slots__ = ('_tid', '_parent', '_offset')
+
+    HEADER_FIELDS = {"tid":"_tid", "parent":"_parent"}
+    CONTENT_FIELDS = {"offset":"_offset"}
+
+    def __init__(self, tid:str, offset:int, parent:str = "") -> None:
+        Letter.__init__(self, Letter.Resume)
+
+        self._tid = tid
+        self._parent = parent
+
+        self._offset = str(offset)
+
+    def offset(self) -> int:
+        return int(self.getContent('offset'))
+
+    @staticmethod
+    def parse(s:bytes) -> Optional['ResumeLetter']:
+        (type_, header, content) = bytesDivide(s)
+
+        if type_ != Letter.Resume:
+            return None
+
+        return ResumeLetter.fromDict(header, content)
+
+    @staticmethod
+    def fromDict(header:Dict, content:Dict) -> 'ResumeLetter':
+        return ResumeLetter(
+            tid = header['tid'],
+            offset = int(content['offset']),
+            parent = header['parent']
+        )
+
+class BatchLetter(Letter):
+
+    __slots__ = ('_frames',)
+
+    CONTENT_FIELDS = {"frames":"_frames"}
+
+    # frames is a sequence of frames of letters
+    def __init__(self, frames:Union[bytes, memoryview]) -> None:
+        Letter.__init__(self, Letter.Batch)
+
+        self._frames = frames
+
+    @staticmethod
+    def ofLetters(letters:Iterable[Letter], compact:int = 0) -> 'BatchLetter':
+        return BatchLetter(b"".join(l.toCompactBytes(compact) for l in letters))
+
+    # Letters within the batch is a view over s
+    @staticmethod
+    def parse(s:bytes) -> Optional['BatchLetter']:
+        return BatchLetter(memoryview(s)[Letter.BATCH_HEADER_LEN:])
+
+    def toBytesWithLength(self) -> bytes:
+        frames = self.getContent('frames')
+
+        return Letter.BATCH_CODE.to_bytes(2, "big") + \
+            len(frames).to_bytes(4, "big") + \
+            frames
+
+    def letters(self) -> Generator[Letter, None, None]:
+        view = memoryview(self.getContent('frames'))
+        pos = 0
+
+        while pos < len(view):
+            frame = view[pos:]
+            size = Letter.frameHeaderLen(frame) + Letter.frameContentLen(frame)
+
+            yield Letter.parse(view[pos:pos+size])
+            pos += size
+
+    def __iter__(self) -> Iterator[Letter]:
+        return self.letters()
+
 validityMethods = {
     Letter.NewTask        :newTaskLetterValidity,
     Letter.Response       :responseLetterValidity,
@@ -504,10 +1274,28 @@ validityMethods = {
     Letter.BinaryFile     :binaryLetterValidity,
     Letter.Log            :logLetterValidity,
     Letter.LogRegister    :logRegisterLetterValidity,
+    Letter.Resume         :resumeLetterValidity,
     Letter.NewMenu        :lambda letter: True,
-    Letter.Command        :lambda letter: True
+    Letter.Command        :lambda letter: True,
+    Letter.Batch          :lambda letter: True
 } # type: Dict[str, Callable]
 
+# Layout of compact letters
+# Type : (Code, Fields), a field is a pair of (part, key)
+compactFormats = {
+    Letter.Response       :(Letter.COMPACT_RESPONSE_CODE,
+                            (("header", "tid"), ("header", "parent"), ("content", "state"))),
+    Letter.PropertyNotify :(Letter.COMPACT_NOTIFY_CODE,
+                            (("header", "ident"), ("header", "compact"),
+                             ("content", "MAX"), ("content", "PROC"))),
+    Letter.Log            :(Letter.COMPACT_LOG_CODE,
+                            (("header", "ident"), ("header", "logId"), ("content", "logMsg")))
+} # type: Dict[str, Tuple[int, Tuple[Tuple[str, str], ...]]]
+
+compactTypes = {
+    code:type_ for (type_, (code, _)) in compactFormats.items()
+} # type: Dict[int, str]
+
 parseMethods = {
     Letter.NewTask        :NewLetter,
     Letter.Response       :ResponseLetter,
@@ -515,6 +1303,462 @@ parseMethods = {
     Letter.BinaryFile     :BinaryLetter,
     Letter.Log            :LogLetter,
     Letter.LogRegister    :LogRegLetter,
+    Letter.Resume         :ResumeLetter,
     Letter.NewMenu        :MenuLetter,
-    Letter.Command        :CommandLetter
+    Letter.Command        :CommandLetter,
+    Letter.Batch          :BatchLetter
 } # type: Any
+
+
+# Incremental decoder of letter frames within a byte stream.
+#
+# Bytes are received into a reusable buffer by socket.recv_into,
+# a frame that larger than the buffer is received into a dedicated
+# bytearray with the same size of the frame so content of the frame
+# is copied at most once.
+class LetterReader:
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, bufSize:int = BUFFER_SIZE) -> None:
+
+        self.__buffer = bytearray(max(bufSize, Letter.BINARY_MAX_HEADER_LEN))
+        self.__view = memoryview(self.__buffer)
+
+        # Bytes that not parsed yet is within [__begin, __end)
+        self.__begin = 0
+        self.__end = 0
+
+        # Buffer of the frame that larger than __buffer
+        self.__large = None # type: Optional[memoryview]
+        self.__largeFill = 0
+
+        # Large letters that received completely, they are
+        # ahead of letters within __buffer.
+        self.__ready = [] # type: List[Any]
+
+    # Receive bytes from sock, return number of bytes received,
+    # 0 means that the peer is closed.
+    def recvFrom(self, sock:socket.socket) -> int:
+        self.__reserve()
+
+        if self.__large is not None:
+            n = sock.recv_into(self.__large[self.__largeFill:])
+            self.__fillLarge(n)
+        else:
+            n = sock.recv_into(self.__view[self.__end:])
+            self.__end += n
+
+        return n
+
+    # Feed bytes that received by other means.
+    def feed(self, data:bytes) -> None:
+        data = memoryview(data)
+
+        while len(data) > 0:
+            self.__reserve()
+
+            if self.__large is not None:
+                size = min(len(data), len(self.__large) - self.__largeFill)
+                self.__large[self.__largeFill:self.__largeFill+size] = data[:size]
+                self.__fillLarge(size)
+            else:
+                size = min(len(data), len(self.__buffer) - self.__end)
+                self.__view[self.__end:self.__end+size] = data[:size]
+                self.__end += size
+
+            data = data[size:]
+
+    # Generate letters that are received completely.
+    def letters(self) -> Generator[Letter, None, None]:
+        while len(self.__ready) > 0:
+            yield self.__popReady()
+
+        while True:
+            size = self.__frameSize()
+
+            if size is None or size > self.__end - self.__begin:
+                # Frame at __begin may be moved into
+                # it's own buffer and finished already.
+                if len(self.__ready) > 0:
+                    yield self.__popReady()
+                    continue
+                return
+
+            # Frame is copied out of __buffer so the
+            # letter is valid after __buffer is reused.
+            frame = bytes(self.__view[self.__begin:self.__begin+size])
+            self.__begin += size
+
+            yield LetterReader.__parseFrame(frame)
+
+    def __popReady(self) -> Letter:
+        ready = self.__ready.pop(0)
+
+        if isinstance(ready, Exception):
+            raise ready
+
+        return ready
+
+    # Receive letters from sock until the peer is closed.
+    def readFrom(self, sock:socket.socket) -> Generator[Letter, None, None]:
+        while self.recvFrom(sock) > 0:
+            yield from self.letters()
+
+    @staticmethod
+    def __parseFrame(frame:Union[bytes, memoryview]) -> Optional[Letter]:
+        headerLen = Letter.frameHeaderLen(frame)
+
+        if headerLen >= Letter.BINARY_HEADER_LEN:
+            view = memoryview(frame)
+            return BinaryLetter.fromHeader(view[:headerLen], view[headerLen:])
+        else:
+            return Letter.parse(frame)
+
+    # Error of parse is raised by letters() in order of frames,
+    # so feed is never failed by a bad frame.
+    def __fillLarge(self, n:int) -> None:
+        self.__largeFill += n
+
+        if self.__largeFill == len(self.__large):
+            large = self.__large
+            self.__large = None
+            self.__largeFill = 0
+
+            try:
+                self.__ready.append(LetterReader.__parseFrame(large))
+            except Exception as e:
+                self.__ready.append(e)
+
+    # Size of the frame at __begin, None if the header of
+    # the frame is not received yet. A frame larger than
+    # __buffer is moved into it's own buffer.
+    def __frameSize(self) -> Optional[int]:
+        if self.__large is not None:
+            return None
+
+        avail = self.__end - self.__begin
+
+        if avail < 2:
+            return None
+
+        headerLen = Letter.frameHeaderLen(self.__view[self.__begin:self.__end])
+        if avail < headerLen:
+            return None
+
+        size = headerLen + Letter.frameContentLen(self.__view[self.__begin:self.__end])
+
+        if size > len(self.__buffer):
+            self.__large = memoryview(bytearray(size))
+            self.__large[:avail] = self.__view[self.__begin:self.__end]
+            self.__begin = self.__end = 0
+            self.__fillLarge(avail)
+
+            return None
+
+        return size
+
+    # Make sure there is room in __buffer for the frame at __begin.
+    def __reserve(self) -> None:
+        size = self.__frameSize()
+
+        if self.__large is not None:
+            return
+
+        avail = self.__end - self.__begin
+
+        if avail == 0:
+            self.__begin = self.__end = 0
+            return
+
+        if size is None:
+            size = Letter.BINARY_MAX_HEADER_LEN
+        if self.__begin + size <= len(self.__buffer) and \
+           self.__end < len(self.__buffer):
+            return
+
+        # Move bytes of unfinished frame to the front of __buffer
+        self.__view[:avail] = self.__view[self.__begin:self.__end]
+        self.__begin, self.__end = 0, avail
+
+        # __buffer is full of frames that not consumed by letters()
+        if self.__end == len(self.__buffer):
+            self.__view.release()
+            self.__buffer.extend(bytes(len(self.__buffer)))
+            self.__view = memoryview(self.__buffer)
+
+
+# Letter exchange over asyncio streams.
+#
+# Frames that sent within the same iteration of event loop are
+# coalesced into one write. send() waits on drain() of the writer
+# so a slow peer pushes back on senders instead of growing buffer
+# of the transport without bound.
+class LetterStream:
+
+    COALESCE_SIZE = 64 * 1024
+
+    def __init__(self, reader:asyncio.StreamReader,
+                 writer:Optional[asyncio.StreamWriter] = None,
+                 coalesceSize:int = COALESCE_SIZE) -> None:
+
+        self.__reader = reader
+        self.__writer = writer
+        self.__coalesceSize = coalesceSize
+
+        # Compact version that the peer support,
+        # 0 means letters are sent in json form.
+        self.__compact = 0
+        self.__compress = Letter.COMPRESS_NONE
+
+        # Frames that not written into transport yet
+        self.__pending = [] # type: List[bytes]
+        self.__pendingSize = 0
+        self.__flushHandle = None # type: Optional[asyncio.Handle]
+
+    @staticmethod
+    async def connect(host:str, port:int) -> 'LetterStream':
+        reader, writer = await asyncio.open_connection(host, port)
+        return LetterStream(reader, writer)
+
+    # Start a server that call handler with a LetterStream
+    # for each connection.
+    @staticmethod
+    async def serve(handler:Callable[['LetterStream'], Awaitable[None]],
+                    host:str, port:int) -> asyncio.AbstractServer:
+
+        async def onConnect(reader:asyncio.StreamReader,
+                            writer:asyncio.StreamWriter) -> None:
+            stream = LetterStream(reader, writer)
+            try:
+                await handler(stream)
+            finally:
+                await stream.close()
+
+        return await asyncio.start_server(onConnect, host, port)
+
+    # Update compact version after the peer advertise
+    # it's version via PropertyNotify letter.
+    def setCompact(self, peerVersion:int) -> None:
+        self.__compact = Letter.compactVersionWith(peerVersion)
+
+    # Compress method of compact letters, binary letters
+    # are compressed as they're created.
+    def setCompress(self, method:str) -> None:
+        self.__compress = method
+
+    def __aiter__(self) -> 'LetterStream':
+        return self
+
+    async def __anext__(self) -> Letter:
+        letter = await self.recv()
+
+        if letter is None:
+            raise StopAsyncIteration
+
+        return letter
+
+    # Receive a letter, None if the peer is closed. A compact
+    # letter that newer than COMPACT_VERSION raise
+    # LETTER_VERSION_NOT_SUPPORTED, it's frame is consumed so
+    # letters after it can still be received.
+    async def recv(self) -> Optional[Letter]:
+        reader = self.__reader
+
+        try:
+            header = await reader.readexactly(2)
+
+            headerLen = Letter.frameHeaderLen(header)
+            if headerLen > 2:
+                header += await reader.readexactly(headerLen - 2)
+
+            content = await reader.readexactly(Letter.frameContentLen(header))
+        except asyncio.IncompleteReadError:
+            return None
+
+        if headerLen >= Letter.BINARY_HEADER_LEN:
+            return BinaryLetter.fromHeader(header, content)
+        else:
+            return Letter.parse(header + content)
+
+    async def send(self, letter:Letter) -> None:
+        if isinstance(letter, BinaryLetter):
+            frames = letter.toBuffers() or []
+        else:
+            frames = [letter.toCompactBytes(self.__compact, self.__compress)]
+
+        for frame in frames:
+            self.__pending.append(frame)
+            self.__pendingSize += len(frame)
+
+        if self.__pendingSize >= self.__coalesceSize:
+            self.__flush()
+        elif self.__flushHandle is None:
+            loop = asyncio.get_running_loop()
+            self.__flushHandle = loop.call_soon(self.__flush)
+
+        await self.__writer.drain()
+
+    async def close(self) -> None:
+        if self.__writer is None:
+            return
+
+        self.__flush()
+        self.__writer.close()
+
+        try:
+            await self.__writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def __flush(self) -> None:
+        if self.__flushHandle is not None:
+            self.__flushHandle.cancel()
+            self.__flushHandle = None
+
+        if self.__pendingSize == 0:
+            return
+
+        # Join small frames only, big one is
+        # handed to the transport as is.
+        smalls = [] # type: List[bytes]
+
+        for frame in self.__pending:
+            if len(frame) < self.__coalesceSize:
+                smalls.append(frame)
+                continue
+
+            if len(smalls) > 0:
+                self.__writer.write(b"".join(smalls))
+                smalls = []
+            self.__writer.write(frame)
+
+        if len(smalls) > 0:
+            self.__writer.write(b"".join(smalls))
+
+        self.__pending = []
+        self.__pendingSize = 0
+
+
+# Coalesce letters into BatchLetters to save syscalls and
+# per frame overhead. A batch is sent once the size of it
+# reach maxSize or the first letter of it wait for maxDelay
+# seconds. send is called with frame of the batch.
+class LetterBatcher:
+
+    MAX_SIZE = 64 * 1024
+    MAX_DELAY = 0.01
+
+    # Seconds that flusher wait for letters before it exit
+    MAX_IDLE = 1.0
+
+    def __init__(self, send:Callable[[bytes], Any],
+                 maxSize:int = MAX_SIZE, maxDelay:float = MAX_DELAY,
+                 compact:int = 0, compress:str = Letter.COMPRESS_NONE) -> None:
+
+        self.__send = send
+        self.__maxSize = maxSize
+        self.__maxDelay = maxDelay
+        self.__compact = compact
+        self.__compress = compress
+
+        self.__frames = [] # type: List[bytes]
+        self.__size = 0
+
+        # Frames are sent with the lock held so
+        # batches are in order of letters.
+        self.__lock = threading.Lock()
+
+        # Batches are flushed after maxDelay by a flusher thread,
+        # it's exit after MAX_IDLE without letters. Error of send
+        # in the flusher is raised by the next add or flush.
+        self.__cond = threading.Condition(self.__lock)
+        self.__deadline = None # type: Optional[float]
+        self.__flusher = None # type: Optional[threading.Thread]
+        self.__closed = False
+        self.__error = None # type: Optional[Exception]
+
+    def add(self, letter:Letter) -> None:
+        frame = letter.toCompactBytes(self.__compact, self.__compress)
+
+        with self.__lock:
+            self.__raiseError()
+
+            self.__frames.append(frame)
+            self.__size += len(frame)
+
+            if self.__size >= self.__maxSize or self.__closed:
+                self.__flush()
+            elif self.__deadline is None:
+                self.__deadline = time.monotonic() + self.__maxDelay
+
+                if self.__flusher is None:
+                    self.__flusher = threading.Thread(target = self.__flushLoop,
+                                                      daemon = True)
+                    self.__flusher.start()
+                else:
+                    self.__cond.notify()
+
+    def flush(self) -> None:
+        with self.__lock:
+            self.__raiseError()
+            self.__flush()
+
+    # Flush pending letters and stop the flusher, letters
+    # added after close are sent immediately.
+    def close(self) -> None:
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify()
+            flusher = self.__flusher
+
+        if flusher is not None:
+            flusher.join()
+
+        self.flush()
+
+    def __raiseError(self) -> None:
+        error = self.__error
+
+        if error is not None:
+            self.__error = None
+            raise error
+
+    def __flushLoop(self) -> None:
+        with self.__cond:
+            while not self.__closed:
+                if self.__deadline is None:
+                    if not self.__cond.wait(LetterBatcher.MAX_IDLE) and \
+                       self.__deadline is None:
+                        break
+                    continue
+
+                remain = self.__deadline - time.monotonic()
+                if remain > 0:
+                    self.__cond.wait(remain)
+                    continue
+
+                try:
+                    self.__flush()
+                except Exception as e:
+                    self.__error = e
+
+            self.__flusher = None
+
+    def __flush(self) -> None:
+        self.__deadline = None
+
+        if len(self.__frames) == 0:
+            return
+
+        if len(self.__frames) == 1:
+            frame = self.__frames[0]
+        else:
+            header = Letter.BATCH_CODE.to_bytes(2, "big") + \
+                self.__size.to_bytes(4, "big")
+            frame = b"".join([header] + self.__frames)
+
+        self.__frames = []
+        self.__size = 0
+
+        self.__send(frame)
@@ -1,8 +1,12 @@
 # mmanager.py
 
-from typing import Callable, Optional, List
-from threading import Thread, Event
-from .util import partition
+from typing import Callable, Optional, List, Dict, Set, Any, Union
+from threading import Thread, Event, Lock, Condition
+from collections import deque
+from .util import Executor
+
+import time
+import traceback
 
 from .type import *
 
@@ -27,20 +31,362 @@ class Module:
     def getName(self) -> str:
         return self.__mName
 
+# Listener is called with (module, alive, error) when run
+# of the module is begin or end.
+Listener = Callable[['ModuleDaemon', bool, Optional[BaseException]], None]
+
 class ModuleDaemon(Module, Daemon):
 
+    # Module is ready once it's running, modules that need to
+    # warm up should set it to False and call setReady().
+    READY_ON_RUN = True
+
     def __init__(self, mName:str) -> None:
         Module.__init__(self, mName)
         Daemon.__init__(self)
 
+        self.__listener = None # type: Optional[Listener]
+        self.__onReady = None # type: Optional[Callable[[], None]]
+        self.__ready = Event()
+        self.__stop = Event()
+        self.__lastBeat = 0.0
+
+        # Thread call self.run, so liveness is reported
+        # even if run is overrided by subclasses.
+        run = self.run
+        self.run = lambda: self.__runWith(run) # type: ignore
+
+    def setListener(self, listener:Optional[Listener],
+                    onReady:Optional[Callable[[], None]] = None) -> None:
+        self.__listener = listener
+        self.__onReady = onReady
+
+    # Subclasses that override stop should call ModuleDaemon.stop
+    # to wake up the run loop.
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def needStop(self) -> bool:
+        return self.__stop.is_set()
+
+    # Wait for timeout seconds or until the module is stopped,
+    # return True if it's stopped. Loop of run should be:
+    #
+    #   while not self.waitOrStop(interval):
+    #       ...
+    def waitOrStop(self, timeout:Optional[float] = None) -> bool:
+        return self.__stop.wait(timeout)
+
+    def setReady(self) -> None:
+        self.__ready.set()
+
+        onReady = self.__onReady
+        if onReady is not None:
+            onReady()
+
+    def isReady(self) -> bool:
+        return self.__ready.is_set()
+
+    def waitReady(self, timeout:Optional[float] = None) -> bool:
+        return self.__ready.wait(timeout)
+
+    # Module should beat periodically if it's supervised
+    # with heartbeat.
+    def beat(self) -> None:
+        self.__lastBeat = time.monotonic()
+
+    def lastBeat(self) -> float:
+        return self.__lastBeat
+
+    def __runWith(self, run:Callable[[], None]) -> None:
+        error = None # type: Optional[BaseException]
+
+        self.beat()
+        self.__notify(True, None)
+
+        if self.READY_ON_RUN:
+            self.setReady()
+
+        try:
+            run()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.__notify(False, error)
+
+    def __notify(self, alive:bool, error:Optional[BaseException]) -> None:
+        listener = self.__listener
+
+        if listener is not None:
+            listener(self, alive, error)
+
+# Supervision of a module
+class ModuleSpec:
+
+    def __init__(self, factory:Optional[Callable[[], Module]],
+                 restart:int, heartbeat:Optional[float],
+                 deps:List[str], timeout:Optional[float]) -> None:
+
+        self.factory = factory
+        self.restart = restart
+        self.heartbeat = heartbeat
+        self.deps = deps
+        self.timeout = timeout
+
+        self.failures = 0
+        self.restarts = 0
+        self.restartAt = None # type: Optional[float]
+        self.startedAt = 0.0
+        self.stopping = False
+
+# Topic is a class or a name, subscribers of a class receive
+# messages of its subclasses too, e.g. subscribers of Letter
+# receive ResponseLetter.
+Topic = Union[type, str]
+
+class Subscription:
+
+    def __init__(self, bus:'MessageBus', topic:Topic,
+                 handler:Callable[[List[Any]], None],
+                 maxQueue:int, policy:int, batch:int) -> None:
+
+        self.topic = topic
+        self.__bus = bus
+        self.__handler = handler
+        self.__maxQueue = max(1, maxQueue)
+        self.__policy = policy
+        self.__batch = max(1, batch)
+
+        self.__queue = deque() # type: deque
+        self.__cond = Condition()
+        self.__scheduled = False
+        self.__closed = False
+
+        self.__delivered = 0
+        self.__dropped = 0
+        self.__failed = 0
+
+    def offer(self, message:Any) -> bool:
+        with self.__cond:
+            if self.__closed:
+                return False
+
+            if len(self.__queue) >= self.__maxQueue:
+                if self.__policy == MessageBus.DROP_NEW:
+                    self.__dropped += 1
+                    return False
+
+                if self.__policy == MessageBus.DROP_OLD:
+                    self.__queue.popleft()
+                    self.__dropped += 1
+                else:
+                    while len(self.__queue) >= self.__maxQueue and not self.__closed:
+                        self.__cond.wait()
+
+                    if self.__closed:
+                        return False
+
+            self.__queue.append(message)
+
+            if self.__scheduled:
+                return True
+            self.__scheduled = True
+
+        self.__bus.schedule(self.__drain)
+
+        return True
+
+    def close(self) -> None:
+        self.__bus.unsubscribe(self)
+
+        with self.__cond:
+            self.__closed = True
+            self.__queue.clear()
+            self.__cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self.__cond:
+            return {
+                "queued": len(self.__queue),
+                "delivered": self.__delivered,
+                "dropped": self.__dropped,
+                "failed": self.__failed
+            }
+
+    # At most one drain of a subscription is scheduled, so
+    # messages are delivered in the order they are published.
+    def __drain(self) -> None:
+        with self.__cond:
+            n = min(self.__batch, len(self.__queue))
+            messages = [self.__queue.popleft() for i in range(n)]
+            self.__cond.notify_all()
+
+        if len(messages) > 0:
+            try:
+                self.__handler(messages)
+            except Exception:
+                traceback.print_exc()
+                with self.__cond:
+                    self.__failed += len(messages)
+            else:
+                with self.__cond:
+                    self.__delivered += len(messages)
+
+        with self.__cond:
+            if len(self.__queue) == 0 or self.__closed:
+                self.__scheduled = False
+                return None
+
+        # Let other subscriptions run between batches
+        self.__bus.schedule(self.__drain)
+
+# In-process publish/subscribe, handlers are run by workers
+# of the bus instead of the thread of the publisher.
+class MessageBus:
+
+    # Policies while queue of a subscription is full
+    DROP_NEW = 0
+    DROP_OLD = 1
+    BLOCK = 2
+
+    # A slow handler holds one worker, others are delivered
+    # as long as slow handlers are fewer than workers.
+    def __init__(self, workers:int = 4) -> None:
+        self.__executor = Executor(workers = workers)
+        self.__subs = {} # type: Dict[Topic, List[Subscription]]
+        self.__lock = Lock()
+
+        # Subscriptions of a class of message, include
+        # subscriptions of its base classes.
+        self.__routes = {} # type: Dict[type, List[Subscription]]
+
+    # handler is called with a list of at most batch messages.
+    # Handler of BLOCK subscription should not publish to
+    # itself, it may wait on itself.
+    def subscribe(self, topic:Topic, handler:Callable[[List[Any]], None],
+                  maxQueue:int = 1024, policy:int = DROP_NEW,
+                  batch:int = 1) -> Subscription:
+
+        sub = Subscription(self, topic, handler, maxQueue, policy, batch)
+
+        # Lists of subscriptions are replaced instead of
+        # modified, publishers use them without lock.
+        with self.__lock:
+            self.__subs[topic] = self.__subs.get(topic, []) + [sub]
+            self.__routes = {}
+
+        return sub
+
+    def unsubscribe(self, sub:Subscription) -> None:
+        with self.__lock:
+            subs = [s for s in self.__subs.get(sub.topic, []) if s is not sub]
+            self.__routes = {}
+
+            if len(subs) == 0:
+                self.__subs.pop(sub.topic, None)
+            else:
+                self.__subs[sub.topic] = subs
+
+    # Message is published to its class and topic if it's
+    # given, return number of subscriptions that accept it.
+    def publish(self, message:Any, topic:Optional[str] = None) -> int:
+        subs = self.__routeOf(type(message))
+
+        if topic is not None:
+            subs = subs + self.__subs.get(topic, [])
+
+        return sum(sub.offer(message) for sub in subs)
+
+    def schedule(self, f:Callable[[], None]) -> None:
+        self.__executor.submit(f)
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.__executor.stats()
+
+        with self.__lock:
+            subs = [sub for subs in self.__subs.values() for sub in subs]
+
+        stats["subscriptions"] = len(subs)
+
+        # Keys of executor are kept, e.g. queued is number of
+        # drains that wait for workers.
+        for k in ("queued", "delivered", "dropped", "failed"):
+            stats["sub" + k.capitalize()] = 0
+
+        for sub in subs:
+            for k, v in sub.stats().items():
+                stats["sub" + k.capitalize()] += v
+
+        return stats
+
+    def close(self) -> None:
+        with self.__lock:
+            subs = [sub for subs in self.__subs.values() for sub in subs]
+
+        for sub in subs:
+            sub.close()
+
+        self.__executor.shutdown(wait = True)
+
+    def __routeOf(self, cls:type) -> List[Subscription]:
+        routes = self.__routes
+        subs = routes.get(cls, None)
+
+        if subs is not None:
+            return subs
+
+        with self.__lock:
+            subs = [sub for c in cls.__mro__ for sub in self.__subs.get(c, [])]
+            self.__routes[cls] = subs
+
+        return subs
+
 ModuleName = str
 
 class MManager:
 
+    # Restart policies
+    RESTART_NEVER = 0
+    RESTART_ON_FAILURE = 1
+    RESTART_ALWAYS = 2
+
+    # Restart delay is doubled on each failure in a row, failures
+    # are forgotten once module is running for BACKOFF_RESET.
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 60.0
+    BACKOFF_RESET = 60.0
+
+    HEARTBEAT_INTERVAL = 1.0
+
+    # Seconds to wait a module to be ready and
+    # modules to exit while they are stopped.
+    START_TIMEOUT = 30.0
+    STOP_GRACE = 10.0
+
     def __init__(self):
         self.__modules = {} # type: Dict[ModuleName, Module]
         self.__num = 0
 
+        # Alive index is updated by events of modules
+        # instead of scan of all modules.
+        self.__alives = {} # type: Dict[ModuleName, Module]
+        self.__dies = {} # type: Dict[ModuleName, Module]
+        self.__unhealthy = set() # type: Set[ModuleName]
+        self.__specs = {} # type: Dict[ModuleName, ModuleSpec]
+
+        self.__lock = Lock()
+        self.__cond = Condition(self.__lock)
+        self.__supervisor = None # type: Optional[Thread]
+        self.__closed = False
+
+        self.__bus = MessageBus()
+
+    # Modules publish to each other through the bus
+    # instead of calls of methods of other modules.
+    def getBus(self) -> MessageBus:
+        return self.__bus
+
     def isModuleExists(self, mName:ModuleName) -> bool:
         return mName in self.__modules
 
@@ -56,53 +402,421 @@ class MManager:
     def getAllModules(self) -> List[Module]:
         return list(self.__modules.values())
 
+    # Modules that are not daemons are always alive
     def getAlives(self) -> List[Module]:
-        (alives, dies) = partition(self.__modules, lambda m: m.is_alive())
-        return alives
+        with self.__lock:
+            return list(self.__alives.values())
 
     def getDies(self) -> List[Module]:
-        (alives, dies) = partition(self.__modules, lambda m: m.is_alive())
-        return dies
-
-    def addModule(self, mName:ModuleName, m:Module) -> State:
-        if self.isModuleExists(mName):
-            return Error
-
-        self.__modules[mName] = m
-        self.__num += 1
+        with self.__lock:
+            return list(self.__dies.values())
+
+    # Supervised modules that not beat within their heartbeat
+    def getUnhealthy(self) -> List[Module]:
+        with self.__lock:
+            return [self.__modules[n] for n in self.__unhealthy]
+
+    # A ModuleDaemon can't be started twice, so factory is required
+    # to restart it, factory should return a new module.
+    #
+    # Module is started after modules in deps are ready and
+    # stopped before them.
+    def addModule(self, mName:ModuleName, m:Module,
+                  factory:Optional[Callable[[], Module]] = None,
+                  restart:int = RESTART_NEVER,
+                  heartbeat:Optional[float] = None,
+                  deps:Optional[List[ModuleName]] = None,
+                  timeout:Optional[float] = None) -> State:
+
+        with self.__lock:
+            if self.isModuleExists(mName):
+                return Error
+
+            self.__modules[mName] = m
+            self.__num += 1
+
+            self.__specs[mName] = ModuleSpec(
+                factory, restart, heartbeat,
+                [] if deps is None else list(deps), timeout)
+            self.__watch(mName, m)
 
         return Ok
 
     def removeModule(self, mName:ModuleName) -> Optional[Module]:
-        if self.isModuleExists(mName):
-            m = self.__modules[mName]
-            del self.__modules [mName]
-            self.__num -= 1
+        with self.__lock:
+            if self.isModuleExists(mName):
+                m = self.__modules[mName]
+                del self.__modules [mName]
+                self.__num -= 1
+
+                del self.__specs[mName]
+                self.__alives.pop(mName, None)
+                self.__dies.pop(mName, None)
+                self.__unhealthy.discard(mName)
+
+                if isinstance(m, ModuleDaemon):
+                    m.setListener(None)
 
-            return m
+                return m
 
         return None
 
+    def restartsOf(self, mName:ModuleName) -> int:
+        with self.__lock:
+            spec = self.__specs.get(mName, None)
+            return 0 if spec is None else spec.restarts
+
     def start(self, mName) -> None:
         if self.isModuleExists(mName):
             m = self.__modules[mName]
+
+            if isinstance(m, ModuleDaemon):
+                self.__superviseStart()
+                self.__specs[mName].stopping = False
+
             m.start()
 
     def stop(self, mName) -> None:
         if self.isModuleExists(mName):
             m = self.__modules[mName]
+
+            with self.__lock:
+                spec = self.__specs[mName]
+                spec.stopping = True
+                spec.restartAt = None
+
             m.stop()
 
-    def startAll(self) -> None:
-        allMods = self.getAllModules()
+    # Stop supervisor and bus, modules are not stopped
+    def close(self) -> None:
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+        supervisor = self.__supervisor
+        if supervisor is not None:
+            supervisor.join()
+
+        self.__bus.close()
+
+    def __watch(self, mName:ModuleName, m:Module) -> None:
+        if not isinstance(m, ModuleDaemon):
+            self.__alives[mName] = m
+            return None
+
+        if m.is_alive():
+            self.__alives[mName] = m
+        else:
+            self.__dies[mName] = m
+
+        m.setListener(lambda m, alive, error:
+                      self.__onEvent(mName, m, alive, error),
+                      self.__onReady)
+
+    def __onReady(self) -> None:
+        with self.__cond:
+            self.__cond.notify_all()
+
+    def __onEvent(self, mName:ModuleName, m:ModuleDaemon, alive:bool,
+                  error:Optional[BaseException]) -> None:
+
+        with self.__cond:
+            # Events of replaced modules
+            if self.__modules.get(mName, None) is not m:
+                return None
+
+            spec = self.__specs[mName]
+
+            if alive:
+                self.__dies.pop(mName, None)
+                self.__alives[mName] = m
+                spec.startedAt = time.monotonic()
+                return None
+
+            self.__alives.pop(mName, None)
+            self.__dies[mName] = m
+            self.__unhealthy.discard(mName)
+
+            # Restart is decided while exit is reported, so module
+            # is never seen died without its restart scheduled.
+            self.__onExit(mName, m, error, time.monotonic())
+            self.__cond.notify_all()
+
+    def __superviseStart(self) -> None:
+        with self.__lock:
+            if self.__supervisor is not None or self.__closed:
+                return None
+
+            self.__supervisor = Thread(target = self.__supervise, daemon = True,
+                                       name = "MManager-supervisor")
+            self.__supervisor.start()
+
+    def __supervise(self) -> None:
+        while True:
+            with self.__cond:
+                if self.__closed:
+                    return None
+
+                now = time.monotonic()
+
+                self.__checkBeats(now)
+                dues = self.__dues(now)
+
+                if len(dues) == 0:
+                    self.__cond.wait(self.__nextWakeup(now))
+
+            for mName in dues:
+                self.__restart(mName)
+
+    def __onExit(self, mName:ModuleName, m:ModuleDaemon,
+                 error:Optional[BaseException], now:float) -> None:
+
+        spec = self.__specs[mName]
+
+        if spec.stopping or spec.factory is None:
+            return None
+        if spec.restart == MManager.RESTART_NEVER:
+            return None
+        if spec.restart == MManager.RESTART_ON_FAILURE and error is None:
+            return None
+
+        if now - spec.startedAt >= MManager.BACKOFF_RESET:
+            spec.failures = 0
+
+        self.__backoff(spec, now)
+
+    def __backoff(self, spec:ModuleSpec, now:float) -> None:
+        delay = min(MManager.BACKOFF_MAX,
+                    MManager.BACKOFF_BASE * (2 ** spec.failures))
+        spec.failures += 1
+        spec.restartAt = now + delay
+
+    def __checkBeats(self, now:float) -> None:
+        for mName in self.__alives:
+            timeout = self.__specs[mName].heartbeat
+            if timeout is None:
+                continue
+
+            m = self.__modules[mName]
+            if now - m.lastBeat() > timeout: # type: ignore
+                self.__unhealthy.add(mName)
+            else:
+                self.__unhealthy.discard(mName)
+
+    # restartAt is cleared by __restart once the module
+    # is replaced, it's pending until then.
+    def __dues(self, now:float) -> List[ModuleName]:
+        dues = []
+
+        for mName, spec in self.__specs.items():
+            if spec.restartAt is not None and spec.restartAt <= now:
+                dues.append(mName)
+
+        return dues
+
+    def __nextWakeup(self, now:float) -> float:
+        wakeup = MManager.HEARTBEAT_INTERVAL
+
+        for spec in self.__specs.values():
+            if spec.restartAt is not None:
+                wakeup = min(wakeup, spec.restartAt - now)
+
+        return max(0.0, wakeup)
+
+    # One for one, only the exited module is restarted
+    def __restart(self, mName:ModuleName) -> None:
+        with self.__lock:
+            spec = self.__specs.get(mName, None)
+            if spec is None or spec.stopping:
+                return None
+
+            # Restart is cancelled by stop
+            if spec.restartAt is None:
+                return None
+
+            factory = spec.factory
+
+        try:
+            m = factory() # type: ignore
+        except Exception:
+            traceback.print_exc()
+
+            with self.__lock:
+                self.__backoff(spec, time.monotonic())
+            return None
+
+        with self.__lock:
+            if self.__specs.get(mName, None) is not spec or spec.stopping:
+                return None
+
+            old = self.__modules[mName]
+            if isinstance(old, ModuleDaemon):
+                old.setListener(None)
+
+            self.__modules[mName] = m
+            self.__dies.pop(mName, None)
+            self.__watch(mName, m)
+            spec.restarts += 1
+            spec.restartAt = None
+
+        m.start() # type: ignore
+
+    # Modules are started in parallel, each one once its
+    # dependencies are ready. Error is returned if dependencies
+    # are cyclic or unknown, or a module is not ready in time,
+    # dependents of such module are not started.
+    def startAll(self) -> State:
+        self.__superviseStart()
+
+        with self.__lock:
+            deps = {n: list(spec.deps) for n, spec in self.__specs.items()}
+
+        if not self.__isAcyclic(deps):
+            return Error
+
+        waiting = {n: set(ds) for n, ds in deps.items()}
+        dependents = self.__dependentsOf(deps)
+        deadlines = {} # type: Dict[ModuleName, float]
+        ready = set() # type: Set[ModuleName]
+        failed = set() # type: Set[ModuleName]
+        launches = [n for n, ds in waiting.items() if len(ds) == 0]
+
+        while True:
+            now = time.monotonic()
+
+            for mName in launches:
+                timeout = self.__specs[mName].timeout
+                deadlines[mName] = now + (MManager.START_TIMEOUT
+                                          if timeout is None else timeout)
+                self.__startIfDies(mName)
+            launches = []
+
+            with self.__cond:
+                for mName in list(deadlines):
+                    state = self.__readiness(mName)
+
+                    if state is None and now < deadlines[mName]:
+                        continue
+
+                    del deadlines[mName]
+
+                    if state is not True:
+                        failed.add(mName)
+                        continue
+
+                    ready.add(mName)
+
+                    for d in dependents[mName]:
+                        waiting[d].discard(mName)
+                        if len(waiting[d]) == 0:
+                            launches.append(d)
+
+                if len(launches) > 0:
+                    continue
+                if len(deadlines) == 0:
+                    break
+
+                self.__cond.wait(max(0.0, min(deadlines.values()) - now))
+
+        return Ok if len(ready) == len(deps) else Error
+
+    # Dependents are stopped before their dependencies, remain
+    # modules are stopped regardless of order once grace is
+    # passed. Error is returned if any module still alive.
+    def stopAll(self, grace:Optional[float] = None) -> State:
+        deadline = time.monotonic() + \
+            (MManager.STOP_GRACE if grace is None else grace)
+
+        with self.__lock:
+            deps = {n: list(spec.deps) for n, spec in self.__specs.items()}
+
+        dependents = self.__dependentsOf(deps)
+        remains = set(deps)
+
+        while True:
+            now = time.monotonic()
+
+            with self.__cond:
+                stops = [n for n in remains
+                         if now >= deadline or
+                         not any(self.__isRunning(d) for d in dependents[n])]
+
+                if len(stops) == 0:
+                    if not any(self.__isRunning(n) for n in deps) or now >= deadline:
+                        break
+
+                    self.__cond.wait(max(0.0, deadline - now))
+                    continue
+
+            for mName in stops:
+                remains.discard(mName)
+
+                if isinstance(self.__modules.get(mName, None), ModuleDaemon):
+                    self.stop(mName)
+
+        for m in self.getAllModules():
+            if isinstance(m, ModuleDaemon) and m.is_alive():
+                m.join(max(0.0, deadline - time.monotonic()))
+
+        with self.__lock:
+            return Error if any(self.__isRunning(n) for n in deps) else Ok
+
+    def __startIfDies(self, mName:ModuleName) -> None:
+        m = self.__modules.get(mName, None)
+
+        if isinstance(m, ModuleDaemon) and m.ident is None:
+            self.start(mName)
+
+    # True if module is ready, False if it's failed
+    # before ready, None if it's not ready yet.
+    def __readiness(self, mName:ModuleName) -> Optional[bool]:
+        m = self.__modules.get(mName, None)
+
+        if m is None:
+            return False
+        if not isinstance(m, ModuleDaemon) or m.isReady():
+            return True
+
+        # Module may be restarted by supervisor
+        if m.ident is not None and not m.is_alive() and \
+           self.__specs[mName].restartAt is None:
+            return False
+
+        return None
+
+    def __isRunning(self, mName:ModuleName) -> bool:
+        m = self.__modules.get(mName, None)
+        return isinstance(m, ModuleDaemon) and m.is_alive()
+
+    @staticmethod
+    def __dependentsOf(deps:Dict[ModuleName, List[ModuleName]]) -> Dict[ModuleName, List[ModuleName]]:
+        dependents = {n: [] for n in deps} # type: Dict[ModuleName, List[ModuleName]]
+
+        for n, ds in deps.items():
+            for d in ds:
+                if d in dependents:
+                    dependents[d].append(n)
+
+        return dependents
+
+    @staticmethod
+    def __isAcyclic(deps:Dict[ModuleName, List[ModuleName]]) -> bool:
+        if any(d not in deps for ds in deps.values() for d in ds):
+            return False
+
+        degrees = {n: len(set(ds)) for n, ds in deps.items()}
+        dependents = MManager.__dependentsOf(
+            {n: list(set(ds)) for n, ds in deps.items()})
+        frees = [n for n, degree in degrees.items() if degree == 0]
+        visited = 0
 
-        for mod in allMods:
-            if isinstance(mod, ModuleDaemon):
-                mod.start()
+        while len(frees) > 0:
+            n = frees.pop()
+            visited += 1
 
-    def stopAll(self) -> None:
-        allMods = self.getAllModules()
+            for d in dependents[n]:
+                degrees[d] -= 1
+                if degrees[d] == 0:
+                    frees.append(d)
 
-        for mod in allMods:
-            if isinstance(mod, ModuleDaemon):
-                mod.stop()
+        return visited == len(deps)
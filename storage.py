@@ -1,10 +1,25 @@
 # Storage
 
 import typing
+import io
 import os
 import platform
 import shutil
 import traceback
+import hashlib
+import json
+import sqlite3
+import contextlib
+import threading
+import time
+import errno
+import struct
+import zlib
+import mmap as mmap_
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from collections import OrderedDict
 
 from manager.misc.basic.type import *
 from manager.misc.basic.util import pathStrConcate
@@ -17,17 +32,185 @@ else:
 class STORAGE_IDENT_NOT_FOUND(Exception):
     pass
 
+def fileDigest(path:str) -> str:
+    h = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+# ioctl of Linux that share extents of a file with another
+FICLONE = 0x40049409
+
+# Bytes copied per syscall
+COPY_CHUNK = 8 * 1024 * 1024
+
+# Make outFd a copy on write clone of inFd
+def reflink(inFd:int, outFd:int) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(outFd, FICLONE, inFd)
+    except (ImportError, OSError):
+        return False
+
+    return True
+
+# Copy content of src to dst within kernel if possible, by
+# reflink, copy_file_range or sendfile in order. progress is
+# called with number of bytes copied.
+def copyFile(src:str, dst:str,
+             progress:typing.Optional[typing.Callable[[int], None]] = None) -> None:
+
+    # Open dst with "wb" truncates src too
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError("%s and %s are the same file" % (src, dst))
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        (inFd, outFd) = (fsrc.fileno(), fdst.fileno())
+        size = os.fstat(inFd).st_size
+
+        if size > 0 and reflink(inFd, outFd):
+            if progress is not None:
+                progress(size)
+            return None
+
+        # copy_file_range may copy in server side of network
+        # file systems but it costs more than sendfile for a
+        # small file.
+        if size >= COPY_CHUNK:
+            methods = [copyRange, copySendfile, copyReadWrite]
+        else:
+            methods = [copySendfile, copyRange, copyReadWrite]
+        offset = 0
+
+        while offset < size:
+            count = min(COPY_CHUNK, size - offset)
+
+            try:
+                n = methods[0](inFd, outFd, offset, count)
+            except OSError as e:
+                # Not supported between these files
+                if len(methods) > 1 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                                    errno.EOPNOTSUPP, errno.EBADF):
+                    methods.pop(0)
+                    continue
+                raise
+
+            # File is truncated while copying
+            if n == 0:
+                break
+
+            offset += n
+
+            if progress is not None:
+                progress(n)
+
+def copyRange(inFd:int, outFd:int, offset:int, count:int) -> int:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range")
+
+    return os.copy_file_range(inFd, outFd, count, offset)
+
+def copySendfile(inFd:int, outFd:int, offset:int, count:int) -> int:
+    if not hasattr(os, "sendfile"):
+        raise OSError(errno.ENOSYS, "sendfile")
+
+    return os.sendfile(outFd, inFd, offset, count)
+
+def copyReadWrite(inFd:int, outFd:int, offset:int, count:int) -> int:
+    content = os.pread(inFd, count, offset)
+
+    view = memoryview(content)
+    while len(view) > 0:
+        view = view[os.write(outFd, view):]
+
+    return len(content)
+
+def treeSize(path:str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    size = 0
+    for (root, dirs, files) in os.walk(path):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+
+    return size
+
+
+# Copy that run by Storage's copy workers
+class StoCopyTask:
+
+    def __init__(self, ident:str, total:int) -> None:
+        self.ident = ident
+        self.future = None # type: typing.Optional[Future]
+
+        self.__total = total
+        self.__copied = 0
+
+    def update(self, count:int) -> None:
+        self.__copied += count
+
+    def copied(self) -> int:
+        return self.__copied
+
+    def total(self) -> int:
+        return self.__total
+
+    def progress(self) -> float:
+        if self.__total == 0:
+            return 1.0 if self.done() else 0.0
+
+        return min(self.__copied / self.__total, 1.0)
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def result(self, timeout:typing.Optional[float] = None) -> State:
+        return self.future.result(timeout) # type: ignore
+
+
 class StoChooser:
 
-    def __init__(self, path:str) -> None:
+    # Sealed files of Storage is opened with mode "rb", a
+    # chooser with pool is returned to the pool while closed.
+    #
+    # onStore is called with number of bytes stored, onClose
+    # is called while the chooser is closed after content is
+    # stored.
+    def __init__(self, path:str, mode:str = "a+b",
+                 pool:typing.Optional['StoPool'] = None,
+                 onStore:typing.Optional[typing.Callable[[int], None]] = None,
+                 onClose:typing.Optional[typing.Callable[['StoChooser'], None]] = None) -> None:
 
         self.__path = path
+        self.__pool = pool
+        self.__onStore = onStore
+        self.__onClose = onClose
+        self.__changed = False
+
+        # Read only map of the file, it's remapped
+        # while the file is grown.
+        self.__map = None # type: typing.Optional[mmap_.mmap]
 
         try:
-            self.__fd = open(path, "a+b")
+            self.__fd = open(path, mode)
         except FileNotFoundError:
             raise STORAGE_IDENT_NOT_FOUND
 
+        # Content is hashed while it's stored, digest is
+        # known only if the file is empty while opened.
+        self.__hash = None # type: typing.Any
+        self.__hashed = 0
+        if mode != "rb" and os.fstat(self.__fd.fileno()).st_size == 0:
+            self.__hash = hashlib.sha256()
+
+        # Descriptor for positional writes, writes of descriptor
+        # opened with O_APPEND are always at the end.
+        self.__wfd = None # type: typing.Optional[int]
+
     def fd(self) -> typing.BinaryIO:
         return self.__fd
 
@@ -54,6 +237,81 @@ class StoChooser:
 
         fd.write(content)
 
+        if self.__hash is not None:
+            self.__hash.update(content)
+            self.__hashed += len(content)
+        self.__changed = True
+
+        if self.__onStore is not None:
+            self.__onStore(len(content))
+
+    # Write content at offset of the file like pwrite, content
+    # is hashed only if it's continue the hashed content.
+    def storeAt(self, offset:int, content:bytes) -> None:
+        # Same as store, sealed content is shared by idents
+        if not self.__fd.writable():
+            raise io.UnsupportedOperation("write")
+
+        size = self.size()
+
+        if self.__wfd is None:
+            self.__wfd = self.__openAt()
+
+        view = memoryview(content)
+        pos = offset
+        while len(view) > 0:
+            n = os.pwrite(self.__wfd, view, pos)
+            view = view[n:]
+            pos += n
+
+        if self.__hash is not None:
+            if offset == self.__hashed:
+                self.__hash.update(content)
+                self.__hashed += len(content)
+            else:
+                self.__hash = None
+        self.__changed = True
+
+        if self.__onStore is not None and pos > size:
+            self.__onStore(pos - size)
+
+    # Path of the chooser may be replaced by publish or seal,
+    # the descriptor must refer to the file of the chooser.
+    def __openAt(self) -> int:
+        wfd = os.open(self.__path, os.O_WRONLY)
+
+        (a, b) = (os.fstat(wfd), os.fstat(self.__fd.fileno()))
+        if (a.st_dev, a.st_ino) != (b.st_dev, b.st_ino):
+            os.close(wfd)
+            raise OSError(errno.ESTALE, "file of chooser is replaced", self.__path)
+
+        return wfd
+
+    def truncate(self, size:int) -> None:
+        if not self.__fd.writable():
+            raise io.UnsupportedOperation("truncate")
+
+        oldSize = self.size()
+
+        # Pages beyond the end of file are not accessible
+        self.__unmap()
+        os.ftruncate(self.__fd.fileno(), size)
+
+        if self.__hash is not None and size != self.__hashed:
+            self.__hash = None
+        self.__changed = True
+
+        if self.__onStore is not None and size != oldSize:
+            self.__onStore(size - oldSize)
+
+    # Hex of sha256 of whole content, None if there are
+    # contents that not stored by the chooser.
+    def digest(self) -> typing.Optional[str]:
+        if self.__hash is None:
+            return None
+
+        return self.__hash.hexdigest()
+
     def retrive(self, count:int) -> bytes:
 
         fd = self.__fd
@@ -62,7 +320,75 @@ class StoChooser:
 
         return content
 
+    def setPool(self, pool:typing.Optional['StoPool']) -> None:
+        self.__pool = pool
+
+    def size(self) -> int:
+        fd = self.__fd
+        fd.flush()
+
+        return os.fstat(fd.fileno()).st_size
+
+    # Read only map of the whole file
+    def mmap(self) -> typing.Optional[mmap_.mmap]:
+        size = self.size()
+
+        if size == 0:
+            return None
+
+        if self.__map is None or len(self.__map) != size:
+            # Views of the old map keep it alive
+            self.__unmap()
+            self.__map = mmap_.mmap(self.__fd.fileno(), size,
+                                    access = mmap_.ACCESS_READ)
+
+        return self.__map
+
+    # Zero copy view of the file, it's not affected by
+    # position of the file so it can be used by holders
+    # of the chooser concurrently.
+    def view(self, offset:int = 0, length:typing.Optional[int] = None) -> memoryview:
+        m = self.mmap()
+
+        if m is None:
+            return memoryview(b"")
+
+        if length is None:
+            return memoryview(m)[offset:]
+        else:
+            return memoryview(m)[offset:offset+length]
+
+    def __unmap(self) -> None:
+        m = self.__map
+        self.__map = None
+
+        if m is not None:
+            try:
+                m.close()
+            except BufferError:
+                # Still exported by views, it's unmapped
+                # while the last view is released.
+                pass
+
     def close(self) -> State:
+        pool = self.__pool
+
+        if self.__changed and self.__onClose is not None:
+            self.__fd.flush()
+            self.__onClose(self)
+        self.__changed = False
+
+        if pool is not None:
+            # Content is visible to other holders of the chooser
+            self.__fd.flush()
+            return pool.release(self)
+
+        self.__unmap()
+
+        if self.__wfd is not None:
+            os.close(self.__wfd)
+            self.__wfd = None
+
         fd = self.__fd
         fd.close()
 
@@ -73,143 +399,1882 @@ class StoChooser:
         fd.seek(0, 0)
 
 
-class Storage:
+# Chooser that pool hand out to a holder, holders of an ident
+# share the opened file but each of them has it's own position
+# of retrive, contents are read by pread.
+class StoPoolChooser(StoChooser):
 
-    def __init__(self, path:str, inst:typing.Any) -> None:
+    def __init__(self, chooser:StoChooser) -> None:
+        self.__chooser = chooser
 
-        self.__sInst = inst
+        # Position of retrive, it's at the end as file
+        # opened with mode "a+b" and at the begin if it's
+        # read only.
+        self.__pos = chooser.size() if chooser.fd().writable() else 0
 
-        self.__crago = {} # type: typing.Dict[str, str]
+    def fd(self) -> typing.BinaryIO:
+        return self.__chooser.fd()
 
-        self.__num = 0
+    def setFd(self, fd) -> State:
+        return Error
 
-        # Need to check that is the path valid
-        self.__path = path
+    def path(self) -> str:
+        return self.__chooser.path()
 
-        # Add target directory's file into Storage
-        Storage.__addDirToCrago(self.__crago, path)
+    def isValid(self) -> bool:
+        return self.__chooser.isValid()
 
-    @staticmethod
-    def __trimExtension(name:str) -> str:
-        parts = name.split(".")
+    def store(self, content:bytes) -> None:
+        self.__chooser.store(content)
+        self.__pos = self.__chooser.size()
 
-        if len(parts) == 1:
-            return name
-        elif len(parts) > 1:
-            return ''.join(parts[0:-1])
-        else:
-            return ""
+    def storeAt(self, offset:int, content:bytes) -> None:
+        self.__chooser.storeAt(offset, content)
 
-    @staticmethod
-    def __addDirToCrago(crago:typing.Dict[str, str], path:str) -> None:
-        global seperator
+    def truncate(self, size:int) -> None:
+        self.__chooser.truncate(size)
 
-        files = os.listdir(path)
-        files = list(filter(lambda f: os.path.isfile(f), files))
-        files = list(map(lambda f: Storage.__trimExtension(f), files))
+    def digest(self) -> typing.Optional[str]:
+        return self.__chooser.digest()
 
-        for f in files:
-            crago[f] = pathStrConcate(path, f, seperator = seperator)
+    def retrive(self, count:int) -> bytes:
+        fd = self.__chooser.fd()
+        fd.flush()
 
-    def create(self, ident:str, ext:str = '') -> typing.Optional[StoChooser]:
-        global seperator
+        content = os.pread(fd.fileno(), count, self.__pos)
+        self.__pos += len(content)
 
-        if ident in self.__crago:
-            return self.open(ident)
+        return content
 
-        path = pathStrConcate(self.__path, ident, seperator = seperator)
-        if ext != '':
-            path += "." + ext
+    def size(self) -> int:
+        return self.__chooser.size()
 
-        chooser = StoChooser(path)
+    def mmap(self) -> typing.Optional[mmap_.mmap]:
+        return self.__chooser.mmap()
 
-        self.__crago[ident] = path
-        self.__num += 1
+    def view(self, offset:int = 0, length:typing.Optional[int] = None) -> memoryview:
+        return self.__chooser.view(offset, length)
 
-        return chooser
+    def close(self) -> State:
+        return self.__chooser.close()
 
-    def open(self, ident:str) -> typing.Optional[StoChooser]:
+    def rewind(self) -> None:
+        self.__pos = 0
 
-        if not ident in self.__crago:
-            return self.create(ident)
 
-        path = self.__crago[ident]
-        chooser = StoChooser(path)
+# Bounded pool of opened StoChoosers, repeated opens of an
+# ident share the same opened file. Choosers are reference counted,
+# a chooser that no one hold is closed while it's evicted in
+# LRU order.
+class StoPool:
+
+    def __init__(self, capacity:int = 128) -> None:
+        self.__capacity = capacity
+        self.__lock = threading.Lock()
+
+        # Least recently used chooser is at front
+        self.__choosers = OrderedDict() # type: OrderedDict[str, StoChooser]
+        self.__refs = {} # type: typing.Dict[StoChooser, int]
+
+        # Choosers that dropped while they're in use, they
+        # are closed by their last holders.
+        self.__dropped = {} # type: typing.Dict[StoChooser, int]
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    # Chooser of ident if it's in the pool
+    def acquire(self, ident:str) -> typing.Optional[StoChooser]:
+        with self.__lock:
+            chooser = self.__acquire(ident)
+
+        if chooser is None:
+            return None
+
+        return StoPoolChooser(chooser)
+
+    def get(self, ident:str, path:str, mode:str = "a+b",
+            onStore:typing.Optional[typing.Callable[[int], None]] = None,
+            onClose:typing.Optional[typing.Callable[[StoChooser], None]] = None) -> StoChooser:
+        with self.__lock:
+            chooser = self.__acquire(ident)
+
+            if chooser is not None:
+                return StoPoolChooser(chooser)
+            else:
+                self.__misses += 1
+                chooser = StoChooser(path, mode, self, onStore, onClose)
+
+                self.__choosers[ident] = chooser
+                self.__refs[chooser] = 0
+
+            self.__refs[chooser] += 1
+            self.__evict()
+
+        return StoPoolChooser(chooser)
+
+    def __acquire(self, ident:str) -> typing.Optional[StoChooser]:
+        chooser = self.__choosers.get(ident, None)
+
+        if chooser is not None:
+            self.__hits += 1
+            self.__refs[chooser] += 1
+            self.__choosers.move_to_end(ident)
 
         return chooser
 
-    def delete(self, ident:str) -> None:
+    def release(self, chooser:StoChooser) -> State:
+        with self.__lock:
+            if chooser in self.__dropped:
+                self.__dropped[chooser] -= 1
+
+                if self.__dropped[chooser] == 0:
+                    del self.__dropped[chooser]
+                    chooser.setPool(None)
+                    chooser.close()
+
+                return Ok
+
+            if chooser not in self.__refs or self.__refs[chooser] == 0:
+                return Error
+
+            self.__refs[chooser] -= 1
+            self.__evict()
+
+        return Ok
+
+    # Drop chooser of ident from the pool, the chooser is closed
+    # by it's last holder if it's still in use.
+    def drop(self, ident:str) -> None:
+        with self.__lock:
+            chooser = self.__choosers.get(ident, None)
+
+            if chooser is not None:
+                self.__remove(ident, chooser)
 
-        if not ident in self.__crago:
+    # Drop chooser of ident only if no one holds it, so it
+    # can't be acquired while it's dropping.
+    def dropIdle(self, ident:str) -> bool:
+        with self.__lock:
+            chooser = self.__choosers.get(ident, None)
+
+            if chooser is None:
+                return True
+            if self.__refs[chooser] > 0:
+                return False
+
+            self.__remove(ident, chooser)
+
+        return True
+
+    def clear(self) -> None:
+        with self.__lock:
+            for (ident, chooser) in list(self.__choosers.items()):
+                self.__remove(ident, chooser)
+
+    # Chooser of ident is held by someone
+    def inUse(self, ident:str) -> bool:
+        with self.__lock:
+            chooser = self.__choosers.get(ident, None)
+
+            return chooser is not None and self.__refs[chooser] > 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {"size":len(self.__choosers), "capacity":self.__capacity,
+                "hits":self.__hits, "misses":self.__misses,
+                "evictions":self.__evictions}
+
+    def __remove(self, ident:str, chooser:StoChooser) -> None:
+        refs = self.__refs.pop(chooser)
+        del self.__choosers [ident]
+
+        if refs == 0:
+            chooser.setPool(None)
+            chooser.close()
+        else:
+            self.__dropped[chooser] = refs
+
+    # Choosers that in use are not evicted so the pool may
+    # exceed it's capacity for a while.
+    def __evict(self) -> None:
+        if len(self.__choosers) <= self.__capacity:
             return None
 
-        path = self.__crago[ident]
+        for (ident, chooser) in list(self.__choosers.items()):
+            if len(self.__choosers) <= self.__capacity:
+                break
 
-        try:
-            os.remove(path)
-        except FileNotFoundError:
-            pass
+            if self.__refs[chooser] == 0:
+                self.__remove(ident, chooser)
+                self.__evictions += 1
 
-        del self.__crago [ident]
-        self.__num -= 1
 
-    def isExists(self, ident:str) -> bool:
-        return ident in self.__crago
+# Chooser of an ident within StoSegments, it has the same
+# semantics with StoChooser but it's not backed by a file.
+class StoSegChooser(StoChooser):
 
-    def numOfFiles(self) -> int:
-        return self.__num
+    def __init__(self, segments:'StoSegments', ident:str) -> None:
+        self.__segments = segments
+        self.__ident = ident
 
-    def getPath(self, ident:str) -> typing.Optional[str]:
-        if not ident in self.__crago:
-            return ""
+        # Position of retrive, it's at the end as
+        # file opened with mode "a+b".
+        self.__pos = segments.size(ident)
 
-        return self.__crago[ident]
+    def fd(self) -> typing.Any:
+        return None
 
-    # User should make sure filePath is within Storage's path
-    def __addNewFile(self, ident, filePath:str) -> State:
-        if ident in self.__crago:
-            return Error
+    def setFd(self, fd) -> State:
+        return Error
 
-        self.__crago[ident] = filePath
+    def path(self) -> str:
+        return ""
+
+    def ident(self) -> str:
+        return self.__ident
+
+    def isValid(self) -> bool:
+        return self.__segments.has(self.__ident)
+
+    def store(self, content:bytes) -> None:
+        self.__segments.append(self.__ident, content)
+        self.__pos = self.__segments.size(self.__ident)
+
+    # Contents of segments are immutable, ident is replaced
+    # with the new content.
+    def storeAt(self, offset:int, content:bytes) -> None:
+        segments = self.__segments
+        size = segments.size(self.__ident)
+
+        if offset == size:
+            self.store(content)
+            return None
+
+        old = segments.read(self.__ident, 0, size)
+        new = old[:offset].ljust(offset, b"\0") + bytes(content) + old[offset+len(content):]
+
+        segments.append(self.__ident, new, StoSegments.REPLACE)
+
+    def truncate(self, size:int) -> None:
+        segments = self.__segments
+        content = segments.read(self.__ident, 0, size)
+
+        segments.append(self.__ident, content, StoSegments.REPLACE)
+
+    def retrive(self, count:int) -> bytes:
+        content = self.__segments.read(self.__ident, self.__pos, count)
+        self.__pos += len(content)
+
+        return content
+
+    def rewind(self) -> None:
+        self.__pos = 0
+
+    def size(self) -> int:
+        return self.__segments.size(self.__ident)
+
+    def digest(self) -> typing.Optional[str]:
+        return None
+
+    def mmap(self) -> typing.Optional[mmap_.mmap]:
+        return None
+
+    def view(self, offset:int = 0, length:typing.Optional[int] = None) -> memoryview:
+        if length is None:
+            length = self.size() - offset
+
+        return memoryview(self.__segments.read(self.__ident, offset, length))
+
+    def close(self) -> State:
         return Ok
 
-    def copy(self, filePath:str) -> State:
 
-        if len(filePath) < 1:
-            return Error
+# Append only log of small idents, contents of idents are
+# packed into segment files instead of a file per ident.
+#
+# A segment is a sequence of records:
+#   kind (1 byte), length of ident (2 bytes), length of data
+#   (4 bytes), crc32 of ident and data (4 bytes), ident, data
+#
+# DATA record append data to ident, REPLACE record reset
+# content of ident to data and DELETE record remove ident.
+# Offsets of contents are indexed in memory and rebuilt
+# from segments during startup.
+class StoSegments:
 
-        if os.path.isfile(filePath):
-            copyMethod = shutil.copy
-        elif os.path.isdir(filePath):
-            copyMethod = shutil.copytree # type: ignore
+    RECORD = struct.Struct(">BHII")
 
-        targetFile = filePath.split(seperator)[-1]
-        stoIdent = targetFile.split(".")[-1]
+    DATA = 1
+    REPLACE = 2
+    DELETE = 3
 
-        dest = self.__path + seperator + targetFile
+    SEGMENT_SIZE = 64 * 1024 * 1024
+
+    # Segment is compacted while the ratio of it's
+    # dead bytes is greater than this.
+    COMPACT_RATIO = 0.5
+
+    # With sync, append return after the record is synced
+    # to disk, appends of threads are synced by a fsync.
+    def __init__(self, path:str, segmentSize:int = SEGMENT_SIZE,
+                 sync:bool = False) -> None:
+
+        self.__path = path
+        self.__segmentSize = segmentSize
+        self.__sync = sync
+
+        self.__lock = threading.RLock()
+
+        # Ident to it's extents (segment, offset, length)
+        self.__extents = {} # type: typing.Dict[str, typing.List[typing.Tuple[int, int, int]]]
+        self.__sizes = {} # type: typing.Dict[str, int]
+
+        # Bytes of segments and bytes of extents within them
+        self.__segSize = {} # type: typing.Dict[int, int]
+        self.__segLive = {} # type: typing.Dict[int, int]
+        self.__readFds = {} # type: typing.Dict[int, int]
+
+        # Segments are compacted by a thread that started while
+        # the active segment is rotated, so appends are not
+        # blocked by compaction.
+        self.__compactLock = threading.Lock()
+        self.__compactions = 0
+        self.__compactWanted = False
+        self.__compactor = None # type: typing.Optional[threading.Thread]
+        self.__closed = False
+
+        # Group commit, sequence of appends written and synced
+        self.__syncCond = threading.Condition()
+        self.__syncing = False
+        self.__written = 0
+        self.__synced = 0
+        self.__fsyncs = 0
+
+        os.makedirs(path, exist_ok = True)
+
+        segs = sorted(int(name[4:-4]) for name in os.listdir(path)
+                      if name.startswith("seg-") and name.endswith(".log"))
+
+        for seg in segs:
+            self.__load(seg, seg == segs[-1])
+
+        self.__active = segs[-1] if len(segs) > 0 else 1
+        self.__activeFd = self.__openActive(self.__active)
+
+    def __segPath(self, seg:int) -> str:
+        return pathStrConcate(self.__path, "seg-%08d.log" % seg, seperator = seperator)
+
+    def __openActive(self, seg:int) -> int:
+        self.__segSize.setdefault(seg, 0)
+        self.__segLive.setdefault(seg, 0)
+
+        return os.open(self.__segPath(seg), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def __readFd(self, seg:int) -> int:
+        fd = self.__readFds.get(seg, None)
+
+        if fd is None:
+            fd = self.__readFds[seg] = os.open(self.__segPath(seg), os.O_RDONLY)
+
+        return fd
+
+    # Records of segment as (kind, ident, offset of data,
+    # length of data, end of record), it's stop at the first
+    # record that is incomplete or corrupted.
+    def __records(self, seg:int) -> typing.Generator[typing.Tuple[int, str, int, int, int], None, None]:
+        with open(self.__segPath(seg), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+
+            if size == 0:
+                return None
+
+            m = mmap_.mmap(f.fileno(), size, access = mmap_.ACCESS_READ)
+
+        header = StoSegments.RECORD
+        view = memoryview(m)
+        pos = 0
 
         try:
-            copyMethod(filePath, dest)
-        except:
-            return Error
+            while pos + header.size <= size:
+                (kind, identLen, dataLen, crc) = header.unpack_from(m, pos)
 
-        self.__addNewFile(stoIdent, dest)
+                start = pos + header.size
+                end = start + identLen + dataLen
 
-        return Ok
+                if end > size or zlib.crc32(view[start:end]) != crc:
+                    break
 
-    def copyTo(self, ident:str, dest:str) -> State:
+                ident = bytes(view[start:start+identLen]).decode()
 
-        if dest == "":
-            return Error
+                yield (kind, ident, start + identLen, dataLen, end)
+                pos = end
+        finally:
+            view.release()
+            m.close()
 
-        if not ident in self.__crago:
-            return Error
+    def __load(self, seg:int, last:bool) -> None:
+        self.__segSize[seg] = 0
+        self.__segLive[seg] = 0
 
-        path = self.__crago[ident]
+        end = 0
+        for (kind, ident, offset, length, end) in self.__records(seg):
+            self.__apply(kind, ident, seg, offset, length)
+
+        self.__segSize[seg] = end
+
+        # Torn write of the last record before shutdown
+        if last and end != os.path.getsize(self.__segPath(seg)):
+            os.truncate(self.__segPath(seg), end)
+
+    def __apply(self, kind:int, ident:str, seg:int, offset:int, length:int) -> None:
+        if kind == StoSegments.DATA and ident in self.__extents:
+            self.__extents[ident].append((seg, offset, length))
+            self.__sizes[ident] += length
+        elif kind == StoSegments.DELETE:
+            self.__kill(ident)
+            return None
+        else:
+            self.__kill(ident)
+            self.__extents[ident] = [(seg, offset, length)]
+            self.__sizes[ident] = length
+
+        self.__segLive[seg] += length
 
+    def __kill(self, ident:str) -> None:
+        for (seg, offset, length) in self.__extents.pop(ident, []):
+            self.__segLive[seg] -= length
+
+        self.__sizes.pop(ident, None)
+
+    def has(self, ident:str) -> bool:
+        return ident in self.__sizes
+
+    def idents(self) -> typing.List[str]:
+        return list(self.__sizes)
+
+    def size(self, ident:str) -> int:
+        return self.__sizes.get(ident, 0)
+
+    def open(self, ident:str) -> StoSegChooser:
+        # Ident is exists after it's first record
+        if not self.has(ident):
+            self.append(ident, b"")
+
+        return StoSegChooser(self, ident)
+
+    def append(self, ident:str, data:bytes, kind:int = DATA) -> None:
+        with self.__lock:
+            self.__appendLocked(kind, ident, data)
+            seq = self.__written
+
+        if self.__sync:
+            self.__waitSync(seq)
+
+    def delete(self, ident:str) -> None:
+        if not self.has(ident):
+            return None
+
+        self.append(ident, b"", StoSegments.DELETE)
+
+    def __appendLocked(self, kind:int, ident:str, data:bytes) -> None:
+        # First record of an ident is always REPLACE, so it
+        # doesn't depend on DELETE records before it.
+        if kind == StoSegments.DATA and not self.has(ident):
+            kind = StoSegments.REPLACE
+
+        identBytes = ident.encode()
+        crc = zlib.crc32(data, zlib.crc32(identBytes))
+        record = StoSegments.RECORD.pack(kind, len(identBytes), len(data), crc) + \
+            identBytes + data
+
+        seg = self.__active
+        if self.__segSize[seg] > 0 and \
+           self.__segSize[seg] + len(record) > self.__segmentSize:
+            seg = self.__rotate()
+
+        offset = self.__segSize[seg]
+
+        view = memoryview(record)
+        while len(view) > 0:
+            view = view[os.write(self.__activeFd, view):]
+
+        self.__segSize[seg] += len(record)
+        self.__written += 1
+
+        self.__apply(kind, ident, seg, offset + len(record) - len(data), len(data))
+
+    # Start a new active segment, segments that mostly
+    # dead are compacted.
+    def __rotate(self) -> int:
+        os.fsync(self.__activeFd)
+        os.close(self.__activeFd)
+
+        self.__active += 1
+        self.__activeFd = self.__openActive(self.__active)
+
+        self.__compactWanted = True
+        if self.__compactor is None:
+            self.__compactor = threading.Thread(target = self.__compactLoop,
+                                                daemon = True)
+            self.__compactor.start()
+
+        return self.__active
+
+    def __compactLoop(self) -> None:
         try:
-            shutil.copy(path, dest)
-        except:
+            while True:
+                with self.__lock:
+                    if not self.__compactWanted or self.__closed:
+                        break
+                    self.__compactWanted = False
+
+                self.compact()
+        finally:
+            with self.__lock:
+                self.__compactor = None
+
+    def __waitSync(self, seq:int) -> None:
+        cond = self.__syncCond
+
+        with cond:
+            while self.__synced < seq:
+                # Another thread is syncing, it may
+                # cover this append.
+                if self.__syncing:
+                    cond.wait()
+                    continue
+
+                self.__syncing = True
+                cond.release()
+
+                try:
+                    # Records of rotated segment is synced
+                    # while it's rotated.
+                    with self.__lock:
+                        target = self.__written
+                        fd = os.dup(self.__activeFd)
+
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                finally:
+                    cond.acquire()
+                    self.__syncing = False
+                    cond.notify_all()
+
+                self.__synced = max(self.__synced, target)
+                self.__fsyncs += 1
+
+    def read(self, ident:str, offset:int, count:int) -> bytes:
+        parts = []
+
+        with self.__lock:
+            for (seg, start, length) in self.__extents.get(ident, []):
+                if count <= 0:
+                    break
+
+                if offset >= length:
+                    offset -= length
+                    continue
+
+                n = min(length - offset, count)
+                parts.append(os.pread(self.__readFd(seg), n, start + offset))
+
+                count -= n
+                offset = 0
+
+        return b"".join(parts)
+
+    # Rewrite idents of segments that mostly dead to the active
+    # segment then remove them, return number of segments that
+    # removed.
+    def compact(self) -> int:
+        with self.__compactLock:
+            with self.__lock:
+                if self.__closed:
+                    return 0
+
+                segs = self.__victims()
+
+            if len(segs) > 0:
+                self.__compactSegments(segs)
+
+        return len(segs)
+
+    # Live idents of victims are rewritten as a whole, so their
+    # extents in other segments become dead too. Segments that
+    # would be mostly dead by that are compacted together.
+    def __victims(self) -> typing.List[int]:
+        ratio = 1 - StoSegments.COMPACT_RATIO
+        victims = set(seg for seg in self.__segSize
+                      if seg != self.__active and
+                      self.__segLive[seg] < self.__segSize[seg] * ratio)
+
+        while len(victims) > 0:
+            moved = {} # type: typing.Dict[int, int]
+
+            for extents in self.__extents.values():
+                if not any(seg in victims for (seg, offset, length) in extents):
+                    continue
+
+                for (seg, offset, length) in extents:
+                    moved[seg] = moved.get(seg, 0) + length
+
+            more = [seg for seg in self.__segSize
+                    if seg != self.__active and seg not in victims and
+                    self.__segLive[seg] - moved.get(seg, 0) < self.__segSize[seg] * ratio]
+
+            if len(more) == 0:
+                break
+
+            victims.update(more)
+
+        return sorted(victims)
+
+    # Idents of segments are rewritten once even if they're
+    # in many of them, then segments are removed. Victims are
+    # not appended anymore so they're scanned without the lock.
+    def __compactSegments(self, segs:typing.List[int]) -> None:
+        victims = set(segs)
+
+        # Ident to the newest segment that it's in
+        idents = {} # type: typing.Dict[str, int]
+
+        for seg in segs:
+            for (kind, ident, offset, length, end) in self.__records(seg):
+                idents[ident] = seg
+
+        for ident in idents:
+            self.__relocate(ident, victims)
+
+        with self.__lock:
+            remains = [seg for seg in self.__segSize if seg not in victims]
+            oldest = min(remains)
+
+            # Hide records of absent idents in older segments
+            for (ident, seg) in idents.items():
+                if not self.has(ident) and oldest < seg:
+                    self.__appendLocked(StoSegments.DELETE, ident, b"")
+
+            os.fsync(self.__activeFd)
+
+            for seg in segs:
+                fd = self.__readFds.pop(seg, None)
+                if fd is not None:
+                    os.close(fd)
+
+                del self.__segSize [seg]
+                del self.__segLive [seg]
+
+                os.remove(self.__segPath(seg))
+
+            self.__compactions += len(segs)
+
+    # Whole content of ident is rewritten so records of the ident
+    # in victims are not needed. Content is read without the lock,
+    # data that appended meanwhile is read with the lock.
+    def __relocate(self, ident:str, victims:typing.Set[int]) -> None:
+        while True:
+            with self.__lock:
+                # Records of the ident in victims are older than
+                # it's REPLACE record if it's not live in them.
+                extents = list(self.__extents.get(ident, []))
+                if not any(seg in victims for (seg, offset, length) in extents):
+                    return None
+
+                fds = [self.__readFd(seg) for (seg, offset, length) in extents]
+
+            parts = [os.pread(fd, length, offset)
+                     for (fd, (seg, offset, length)) in zip(fds, extents)]
+
+            with self.__lock:
+                current = self.__extents.get(ident, [])
+
+                # Ident is replaced or deleted meanwhile
+                if current[:len(extents)] != extents:
+                    continue
+
+                for (seg, offset, length) in current[len(extents):]:
+                    parts.append(os.pread(self.__readFd(seg), length, offset))
+
+                self.__appendLocked(StoSegments.REPLACE, ident, b"".join(parts))
+
+            return None
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self.__lock:
+            return {"idents":len(self.__sizes), "segments":len(self.__segSize),
+                    "bytes":sum(self.__segSize.values()),
+                    "live":sum(self.__segLive.values()),
+                    "compactions":self.__compactions, "fsyncs":self.__fsyncs}
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__closed = True
+            compactor = self.__compactor
+
+        if compactor is not None:
+            compactor.join()
+
+        with self.__lock:
+            os.fsync(self.__activeFd)
+            os.close(self.__activeFd)
+
+            for fd in self.__readFds.values():
+                os.close(fd)
+            self.__readFds.clear()
+
+
+# Persistent index of Storage, a record of ident is a dict.
+#
+# Records are kept in a sqlite database so they are loaded
+# on demand instead of all at once during startup. Path and
+# digest of records are columns for bulk loading.
+#
+# StoIndex is shared by threads, modifications within a
+# batch is not interleaved with other threads.
+class StoIndex:
+
+    def __init__(self, path:str) -> None:
+        self.__path = path
+        self.__lock = threading.RLock()
+
+        self.__db = sqlite3.connect(path, isolation_level = None,
+                                    check_same_thread = False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "ident TEXT PRIMARY KEY, path TEXT, digest TEXT, record TEXT)")
+
+    def get(self, ident:str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT record FROM records WHERE ident = ?", (ident,)).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def idents(self) -> typing.List[str]:
+        with self.__lock:
+            return [row[0] for row in self.__db.execute("SELECT ident FROM records")]
+
+    def records(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        with self.__lock:
+            return {row[0]:json.loads(row[1])
+                    for row in self.__db.execute("SELECT ident, record FROM records")}
+
+    # (ident, path) of all records that has path
+    def paths(self) -> typing.List[typing.Tuple[str, str]]:
+        with self.__lock:
+            return self.__db.execute(
+                "SELECT ident, path FROM records WHERE path IS NOT NULL").fetchall()
+
+    # (ident, digest) of all records that has digest
+    def digests(self) -> typing.List[typing.Tuple[str, str]]:
+        with self.__lock:
+            return self.__db.execute(
+                "SELECT ident, digest FROM records WHERE digest IS NOT NULL").fetchall()
+
+    def put(self, ident:str, record:typing.Dict[str, typing.Any]) -> None:
+        row = (ident, record.get("path", None), record.get("digest", None),
+               json.dumps(record))
+
+        with self.__lock:
+            self.__db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", row)
+
+    def remove(self, ident:str) -> None:
+        with self.__lock:
+            self.__db.execute("DELETE FROM records WHERE ident = ?", (ident,))
+
+    # Modifications within the block are committed at once
+    @contextlib.contextmanager
+    def batch(self) -> typing.Iterator[None]:
+        with self.__lock:
+            self.__db.execute("BEGIN")
+            try:
+                yield None
+            except:
+                self.__db.execute("ROLLBACK")
+                raise
+            self.__db.execute("COMMIT")
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__db.close()
+
+
+class Storage:
+
+    INDEX_NAME = ".stoindex"
+    BLOB_DIR = ".blobs"
+    STAGE_DIR = ".stage"
+    SEGMENT_DIR = ".segments"
+
+    # Number of locks that idents are distributed to
+    LOCK_STRIPES = 64
+
+    # Eviction policies of capacity bounded Storage
+    EVICT_LRU = "lru"
+    EVICT_LFU = "lfu"
+    EVICT_TTL = "ttl"
+
+    # Eviction is stop while usage is under the
+    # ratio of capacity.
+    LOW_WATER = 0.9
+
+    # Record of the directory within index,
+    # it's not a valid ident of files.
+    DIR_RECORD = "."
+
+    # With dedup a sealed file is stored once in blob directory
+    # by it's digest, files of idents with the same content are
+    # hardlinks of the blob.
+    #
+    # At most maxHandles idle files are kept opened.
+    #
+    # Storage is safe to be used by threads, operations of an
+    # ident is serialized by the lock of it's stripe so idents
+    # of different stripes are not contend with each other.
+    #
+    # With capacity, total size of files is bounded in bytes,
+    # idents are evicted by policy while it's exceeded. Evicted
+    # files are moved to coldPath if it's given and moved back
+    # while they are opened.
+    #
+    # Idents that created with extension within segmentExts
+    # are packed into segment files, they are not files
+    # within the directory.
+    def __init__(self, path:str, inst:typing.Any, dedup:bool = False,
+                 maxHandles:int = 128, capacity:typing.Optional[int] = None,
+                 policy:str = EVICT_LRU, ttl:typing.Optional[float] = None,
+                 coldPath:typing.Optional[str] = None, copyWorkers:int = 4,
+                 segmentExts:typing.Optional[typing.Iterable[str]] = None,
+                 segmentSync:bool = False) -> None:
+
+        self.__sInst = inst
+
+        self.__crago = {} # type: typing.Dict[str, str]
+
+        self.__locks = [threading.RLock() for i in range(Storage.LOCK_STRIPES)]
+
+        # Guard of blobs and refs of them
+        self.__blobLock = threading.Lock()
+
+        # Staged choosers to their idents and paths
+        self.__staged = {} # type: typing.Dict[StoChooser, typing.Tuple[str, str]]
+
+        # Need to check that is the path valid
+        self.__path = path
+
+        self.__dedup = dedup
+
+        # Number of idents that refer to a blob
+        self.__refs = {} # type: typing.Dict[str, int]
+
+        self.__pool = StoPool(maxHandles)
+
+        self.__capacity = capacity
+        self.__policy = policy
+        self.__ttl = ttl
+        self.__coldPath = coldPath
+
+        # [size, atime, hits] of idents within hot directory,
+        # it's tracked only if capacity is given.
+        self.__usage = {} # type: typing.Dict[str, typing.List[typing.Any]]
+        self.__used = 0
+        self.__usageLock = threading.Lock()
+        self.__evictLock = threading.Lock()
+        self.__lastExpire = 0.0
+
+        # Idents that usage is changed since loaded
+        self.__dirty = set() # type: typing.Set[str]
+
+        # Idents that demoted into coldPath
+        self.__cold = set() # type: typing.Set[str]
+
+        self.__evictions = 0
+        self.__demotions = 0
+        self.__promotions = 0
+
+        # Workers of copyMany and copyManyTo, it's
+        # created while it's first used.
+        self.__copyWorkers = copyWorkers
+        self.__copyExecutor = None # type: typing.Optional[ThreadPoolExecutor]
+        self.__copyLock = threading.Lock()
+
+        if coldPath is not None:
+            os.makedirs(coldPath, exist_ok = True)
+
+        self.__segmentExts = set(segmentExts) if segmentExts is not None else set()
+        self.__segments = None # type: typing.Optional[StoSegments]
+
+        if len(self.__segmentExts) > 0:
+            self.__segments = StoSegments(
+                pathStrConcate(path, Storage.SEGMENT_DIR, seperator = seperator),
+                sync = segmentSync)
+
+        if dedup:
+            os.makedirs(self.__blobPath(""), exist_ok = True)
+
+        # Staged files that not published before last shutdown
+        # are useless, the directory itself is kept so mtime of
+        # the storage directory is not changed.
+        stageDir = pathStrConcate(path, Storage.STAGE_DIR, seperator = seperator)
+        os.makedirs(stageDir, exist_ok = True)
+        with os.scandir(stageDir) as entries:
+            for entry in entries:
+                os.remove(entry.path)
+
+        # Catalog of files within the directory, record
+        # of an ident is {path, size, mtime, digest}. Database
+        # is placed in it's own directory so journal files of it
+        # won't change mtime of the storage directory.
+        indexDir = pathStrConcate(path, Storage.INDEX_NAME, seperator = seperator)
+        os.makedirs(indexDir, exist_ok = True)
+        self.__index = StoIndex(
+            pathStrConcate(indexDir, "index.db", seperator = seperator))
+
+        # Add target directory's file into Storage
+        self.__loadCrago()
+
+    @staticmethod
+    def __trimExtension(name:str) -> str:
+        parts = name.split(".")
+
+        if len(parts) == 1:
+            return name
+        elif len(parts) > 1:
+            return '.'.join(parts[0:-1])
+        else:
+            return ""
+
+    # Load crago from index, the directory is scanned only if
+    # it's modified since last time the index is validated.
+    def __loadCrago(self) -> None:
+        index = self.__index
+        dirRecord = index.get(Storage.DIR_RECORD)
+
+        if dirRecord is None or dirRecord["mtime"] != self.__dirMtime():
+            self.__scanDir()
+
+        self.__crago = dict(index.paths())
+
+        for (ident, digest) in index.digests():
+            self.__refs[digest] = self.__refs.get(digest, 0) + 1
+
+        if self.__capacity is None and self.__coldPath is None:
+            return None
+
+        for (ident, record) in index.records().items():
+            if ident == Storage.DIR_RECORD:
+                continue
+
+            if record.get("cold", False):
+                self.__cold.add(ident)
+            elif self.__capacity is not None:
+                atime = record.get("atime", record["mtime"] / 1e9)
+                self.__usage[ident] = [record["size"], atime, record.get("hits", 0)]
+                self.__used += record["size"]
+
+    # Validate index with files within the directory, records
+    # of files that not modified since last validation is kept.
+    def __scanDir(self) -> None:
+        with self.__index.batch():
+            self.__scanDirRecords()
+
+    def __scanDirRecords(self) -> None:
+        index = self.__index
+        records = index.records()
+        alives = set() # type: typing.Set[str]
+
+        with os.scandir(self.__path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+
+                ident = Storage.__trimExtension(entry.name)
+                record = records.get(ident, None)
+
+                if not entry.is_file():
+                    # Directory that copied into Storage
+                    if record is not None and record["path"] == entry.path:
+                        alives.add(ident)
+                    continue
+
+                st = entry.stat()
+                alives.add(ident)
+
+                if record is not None and record["path"] == entry.path and \
+                   record["size"] == st.st_size and record["mtime"] == st.st_mtime_ns:
+                    continue
+
+                index.put(ident, {"path":entry.path, "size":st.st_size,
+                                  "mtime":st.st_mtime_ns})
+
+        for (ident, record) in records.items():
+            if ident in alives or ident == Storage.DIR_RECORD:
+                continue
+
+            # Files in cold tier are not within the directory
+            if record.get("cold", False) and os.path.exists(record["path"]):
+                continue
+
+            index.remove(ident)
+
+        self.__updateDirRecord()
+
+    def __dirMtime(self) -> int:
+        return os.stat(self.__path).st_mtime_ns
+
+    # Index is valid with current state of the directory
+    def __updateDirRecord(self) -> None:
+        self.__index.put(Storage.DIR_RECORD, {"mtime":self.__dirMtime()})
+
+    # digest is the blob that ident is linked to, checksum is
+    # sha256 of content of ident. Fields that not derived from
+    # the file such as committed are kept, synced means the
+    # whole file is committed.
+    def __record(self, ident:str, path:str, digest:typing.Optional[str] = None,
+                 cold:bool = False, checksum:typing.Optional[str] = None,
+                 synced:bool = False) -> None:
+        try:
+            st = os.stat(path)
+            (size, mtime) = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            (size, mtime) = (0, 0)
+
+        with self.__index.batch():
+            old = self.__index.get(ident)
+
+            record = {} if old is None else \
+                {k: v for (k, v) in old.items() if k not in ("digest", "sha256", "cold")}
+            record.update({"path":path, "size":size, "mtime":mtime})
+
+            if synced:
+                record["committed"] = size
+            if digest is not None:
+                record["digest"] = digest
+                checksum = digest
+            if checksum is not None:
+                record["sha256"] = checksum
+            if cold:
+                record["cold"] = True
+            else:
+                self.__account(ident, size, record)
+
+            self.__index.put(ident, record)
+            self.__updateDirRecord()
+
+    def close(self) -> None:
+        if self.__copyExecutor is not None:
+            self.__copyExecutor.shutdown(wait = True)
+
+        self.__pool.clear()
+        self.__saveUsage()
+        self.__index.close()
+
+        if self.__segments is not None:
+            self.__segments.close()
+
+    def segmentStats(self) -> typing.Dict[str, int]:
+        if self.__segments is None:
+            return {}
+
+        return self.__segments.stats()
+
+    def __isSegmented(self, ident:str) -> bool:
+        return self.__segments is not None and self.__segments.has(ident)
+
+    def poolStats(self) -> typing.Dict[str, int]:
+        return self.__pool.stats()
+
+    def capacityStats(self) -> typing.Dict[str, typing.Any]:
+        return {"capacity":self.__capacity, "used":self.__used,
+                "policy":self.__policy, "cold":len(self.__cold),
+                "evictions":self.__evictions, "demotions":self.__demotions,
+                "promotions":self.__promotions}
+
+    # Set size of ident, usage of ident is saved into record
+    def __account(self, ident:str, size:int, record:typing.Dict[str, typing.Any]) -> None:
+        if self.__capacity is None:
+            return None
+
+        with self.__usageLock:
+            usage = self.__usage.get(ident, None)
+
+            if usage is None:
+                usage = self.__usage[ident] = [size, time.time(), 0]
+                self.__used += size
+            else:
+                self.__used += size - usage[0]
+                usage[0] = size
+
+            record["atime"] = usage[1]
+            record["hits"] = usage[2]
+
+    # Content is appended to ident by it's chooser
+    def __grow(self, ident:str, count:int) -> None:
+        with self.__usageLock:
+            usage = self.__usage.get(ident, None)
+
+            if usage is not None:
+                usage[0] += count
+                self.__used += count
+                self.__dirty.add(ident)
+
+        self.__enforce()
+
+    def __touch(self, ident:str) -> None:
+        if self.__capacity is None:
+            return None
+
+        with self.__usageLock:
+            usage = self.__usage.get(ident, None)
+
+            if usage is not None:
+                usage[1] = time.time()
+                usage[2] += 1
+                self.__dirty.add(ident)
+
+    def __forget(self, ident:str) -> None:
+        with self.__usageLock:
+            usage = self.__usage.pop(ident, None)
+
+            if usage is not None:
+                self.__used -= usage[0]
+
+            self.__dirty.discard(ident)
+
+    def __onCloseOf(self, ident:str) -> typing.Callable[[StoChooser], None]:
+        return lambda chooser: self.__saveChecksum(ident, chooser)
+
+    # Checksum that computed by chooser while storing is saved
+    # into record of ident, checksum of ident is dropped if
+    # some of content is not hashed.
+    def __saveChecksum(self, ident:str, chooser:StoChooser) -> None:
+        digest = chooser.digest()
+
+        try:
+            st = os.stat(chooser.path())
+        except FileNotFoundError:
+            return None
+
+        with self.__index.batch():
+            record = self.__index.get(ident)
+
+            if record is None or record["path"] != chooser.path():
+                return None
+
+            (record["size"], record["mtime"]) = (st.st_size, st.st_mtime_ns)
+            if digest is None:
+                record.pop("sha256", None)
+            else:
+                record["sha256"] = digest
+
+            self.__index.put(ident, record)
+            self.__updateDirRecord()
+
+    # Hex of sha256 of content of ident that computed while
+    # it's stored, None if it's unknown.
+    def checksumOf(self, ident:str) -> typing.Optional[str]:
+        record = self.__index.get(ident)
+
+        if record is None or "sha256" not in record:
+            return None
+
+        # Modified without Storage
+        try:
+            st = os.stat(record["path"])
+        except FileNotFoundError:
+            return None
+
+        if st.st_size != record["size"] or st.st_mtime_ns != record["mtime"]:
+            return None
+
+        return record["sha256"]
+
+    def __onStoreOf(self, ident:str) -> typing.Optional[typing.Callable[[int], None]]:
+        if self.__capacity is None:
+            return None
+
+        return lambda count: self.__grow(ident, count)
+
+    # Usages of idents are written into index at once
+    # instead of each time it's changed.
+    def __saveUsage(self) -> None:
+        with self.__usageLock:
+            dirty = [(ident, self.__usage[ident]) for ident in self.__dirty
+                     if ident in self.__usage]
+            self.__dirty.clear()
+
+        with self.__index.batch():
+            for (ident, usage) in dirty:
+                record = self.__index.get(ident)
+
+                if record is None:
+                    continue
+
+                (record["size"], record["atime"], record["hits"]) = usage
+                self.__index.put(ident, record)
+
+    # Evict idents if capacity is exceeded or there are
+    # idents that expired.
+    def __enforce(self) -> None:
+        if self.__capacity is None:
+            return None
+
+        now = time.time()
+        expire = self.__policy == Storage.EVICT_TTL and self.__ttl is not None and \
+            now - self.__lastExpire >= 1.0
+
+        if self.__used <= self.__capacity and not expire:
+            return None
+
+        # Only one thread do eviction
+        if not self.__evictLock.acquire(blocking = False):
+            return None
+
+        try:
+            if expire:
+                self.__lastExpire = now
+            self.__evict(now)
+        finally:
+            self.__evictLock.release()
+
+    def __evict(self, now:float) -> None:
+        with self.__usageLock:
+            candidates = [(ident, usage[1], usage[2])
+                          for (ident, usage) in self.__usage.items()]
+
+        if self.__policy == Storage.EVICT_LFU:
+            candidates.sort(key = lambda c: (c[2], c[1]))
+        else:
+            candidates.sort(key = lambda c: c[1])
+
+        ttl = self.__ttl if self.__policy == Storage.EVICT_TTL else None
+        over = self.__used > self.__capacity # type: ignore
+        low = self.__capacity * Storage.LOW_WATER # type: ignore
+
+        for (ident, atime, hits) in candidates:
+            expired = ttl is not None and now - atime > ttl
+
+            if not expired and not (over and self.__used > low):
+                break
+
+            self.__evictIdent(ident)
+
+    def __evictIdent(self, ident:str) -> None:
+        lock = self.__lockOf(ident)
+
+        # Ident that in use is skipped
+        if not lock.acquire(blocking = False):
+            return None
+
+        try:
+            if ident not in self.__crago or ident in self.__cold or \
+               self.__pool.inUse(ident):
+                return None
+
+            if self.__coldPath is not None:
+                self.__demote(ident)
+            else:
+                self.__delete(ident)
+
+            self.__evictions += 1
+        except OSError:
+            traceback.print_exc()
+        finally:
+            lock.release()
+
+    # Move file of ident into cold tier, content of sealed
+    # ident is copied since the blob may still be in use.
+    def __demote(self, ident:str) -> None:
+        path = self.__crago[ident]
+        dest = pathStrConcate(self.__coldPath, os.path.basename(path), # type: ignore
+                              seperator = seperator)
+
+        self.__pool.drop(ident)
+        checksum = self.checksumOf(ident)
+
+        if self.isSealed(ident):
+            shutil.copyfile(path, dest)
+            os.remove(path)
+            self.__unseal(ident)
+        else:
+            shutil.move(path, dest)
+
+        self.__forget(ident)
+        self.__cold.add(ident)
+        self.__crago[ident] = dest
+
+        self.__record(ident, dest, cold = True, checksum = checksum)
+        self.__demotions += 1
+
+    def __promote(self, ident:str) -> None:
+        path = self.__crago[ident]
+        dest = pathStrConcate(self.__path, os.path.basename(path),
+                              seperator = seperator)
+
+        checksum = self.checksumOf(ident)
+        shutil.move(path, dest)
+
+        self.__cold.discard(ident)
+        self.__crago[ident] = dest
+
+        self.__record(ident, dest, checksum = checksum)
+        self.__promotions += 1
+
+    def isCold(self, ident:str) -> bool:
+        return ident in self.__cold
+
+    def __lockOf(self, ident:str) -> threading.RLock:
+        return self.__locks[hash(ident) % Storage.LOCK_STRIPES]
+
+    def __pathOf(self, ident:str, ext:str) -> str:
+        path = pathStrConcate(self.__path, ident, seperator = seperator)
+        if ext != '':
+            path += "." + ext
+
+        return path
+
+    def create(self, ident:str, ext:str = '') -> typing.Optional[StoChooser]:
+        with self.__lockOf(ident):
+            if ident in self.__crago or self.__isSegmented(ident):
+                return self.open(ident)
+
+            if ext in self.__segmentExts:
+                return self.__segments.open(ident) # type: ignore
+
+            path = self.__pathOf(ident, ext)
+            chooser = self.__pool.get(ident, path, onStore = self.__onStoreOf(ident),
+                                      onClose = self.__onCloseOf(ident))
+
+            self.__crago[ident] = path
+            self.__record(ident, path)
+
+        self.__enforce()
+
+        return chooser
+
+    def open(self, ident:str) -> typing.Optional[StoChooser]:
+
+        if self.__isSegmented(ident):
+            return self.__segments.open(ident) # type: ignore
+
+        # Pooled chooser of sealed ident is read only since
+        # chooser of ident is dropped while it's sealed.
+        chooser = self.__pool.acquire(ident)
+        if chooser is not None:
+            self.__touch(ident)
+            return chooser
+
+        with self.__lockOf(ident):
+            if not ident in self.__crago:
+                return self.create(ident)
+
+            if ident in self.__cold:
+                self.__promote(ident)
+
+            path = self.__crago[ident]
+
+            # Content of sealed ident is shared with other idents
+            if self.isSealed(ident):
+                chooser = self.__pool.get(ident, path, "rb")
+            else:
+                chooser = self.__pool.get(ident, path,
+                                          onStore = self.__onStoreOf(ident),
+                                          onClose = self.__onCloseOf(ident))
+
+            self.__touch(ident)
+
+        self.__enforce()
+
+        return chooser
+
+    # Chooser of a temporary file that become content of
+    # ident while it's published, content of ident is
+    # replaced atomically so readers never see partial
+    # content of the file.
+    def stage(self, ident:str, ext:str = '') -> StoChooser:
+        tmp = pathStrConcate(self.__path, Storage.STAGE_DIR,
+                             ident + "." + os.urandom(8).hex(),
+                             seperator = seperator)
+
+        chooser = StoChooser(tmp, "w+b")
+        self.__staged[chooser] = (ident, self.__pathOf(ident, ext))
+
+        return chooser
+
+    def publish(self, chooser:StoChooser) -> State:
+        staged = self.__staged.pop(chooser, None)
+
+        if staged is None:
+            return Error
+
+        (ident, path) = staged
+        checksum = chooser.digest()
+
+        chooser.fd().flush()
+        os.fsync(chooser.fd().fileno())
+        chooser.close()
+
+        with self.__lockOf(ident):
+            old = self.__crago.get(ident, None)
+
+            try:
+                os.replace(chooser.path(), path)
+            except OSError:
+                traceback.print_exc()
+                return Error
+
+            # Holders of old chooser still read the old content
+            self.__pool.drop(ident)
+            self.__unseal(ident)
+
+            if old is not None and old != path:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+            self.__cold.discard(ident)
+            self.__crago[ident] = path
+            self.__record(ident, path, checksum = checksum, synced = True)
+
+        self.__enforce()
+
+        return Ok
+
+    # Drop a staged chooser without publish
+    def discard(self, chooser:StoChooser) -> None:
+        if self.__staged.pop(chooser, None) is None:
+            return None
+
+        chooser.close()
+
+        try:
+            os.remove(chooser.path())
+        except FileNotFoundError:
+            pass
+
+    def delete(self, ident:str) -> None:
+        with self.__lockOf(ident):
+            if self.__isSegmented(ident):
+                self.__segments.delete(ident) # type: ignore
+                return None
+
+            if not ident in self.__crago:
+                return None
+
+            self.__delete(ident)
+
+    def __delete(self, ident:str) -> None:
+        path = self.__crago[ident]
+
+        self.__pool.drop(ident)
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        self.__unseal(ident)
+        self.__forget(ident)
+        self.__cold.discard(ident)
+
+        del self.__crago [ident]
+
+        with self.__index.batch():
+            self.__index.remove(ident)
+            self.__updateDirRecord()
+
+    # Bytes of ident that are kept even if the system is crashed,
+    # content is committed up to the end if offset is not given.
+    def commit(self, ident:str, offset:typing.Optional[int] = None,
+               sync:bool = True) -> int:
+
+        with self.__lockOf(ident):
+            if self.__isSegmented(ident):
+                return self.__segments.size(ident) # type: ignore
+
+            path = self.__crago.get(ident, None)
+            if path is None:
+                return 0
+
+            chooser = self.__pool.acquire(ident)
+            if chooser is not None:
+                chooser.fd().flush()
+                chooser.close()
+
+            if sync:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+            size = os.path.getsize(path)
+            offset = size if offset is None else min(offset, size)
+
+            with self.__index.batch():
+                record = self.__index.get(ident)
+
+                if record is not None:
+                    record["committed"] = offset
+                    self.__index.put(ident, record)
+
+        return offset
+
+    def committed(self, ident:str) -> int:
+        if self.__isSegmented(ident):
+            return self.__segments.size(ident) # type: ignore
+
+        record = self.__index.get(ident)
+
+        if record is None:
+            return 0
+
+        try:
+            size = os.path.getsize(record["path"])
+        except FileNotFoundError:
+            return 0
+
+        # Content of sealed ident is complete
+        if "digest" in record:
+            return size
+
+        return min(record.get("committed", 0), size)
+
+    # Offset that a transfer of ident should continue from,
+    # bytes that not committed are dropped.
+    def resume(self, ident:str) -> int:
+        offset = self.committed(ident)
+
+        if self.isSealed(ident):
+            return offset
+
+        with self.__lockOf(ident):
+            if not ident in self.__crago and not self.__isSegmented(ident):
+                return 0
+
+            chooser = self.open(ident)
+
+            try:
+                if chooser.size() > offset: # type: ignore
+                    chooser.truncate(offset) # type: ignore
+            finally:
+                chooser.close() # type: ignore
+
+        return offset
+
+    def isSealed(self, ident:str) -> bool:
+        return self.digestOf(ident) is not None
+
+    def digestOf(self, ident:str) -> typing.Optional[str]:
+        record = self.__index.get(ident)
+
+        if record is None:
+            return None
+
+        return record.get("digest", None)
+
+    # Content of ident is immutable after sealed, the file
+    # of ident is replaced by a hardlink of the blob that
+    # has the same content.
+    def seal(self, ident:str) -> State:
+        if not self.__dedup:
+            return Error
+
+        with self.__lockOf(ident):
+            if not ident in self.__crago:
+                return Error
+
+            if self.isSealed(ident):
+                return Ok
+
+            path = self.__crago[ident]
+
+            # Opened file of ident is writable, content that
+            # written by holders of it would be in the blob.
+            # Once it's dropped, opens of ident wait for the
+            # stripe lock and get the read only chooser.
+            if not self.__pool.dropIdle(ident):
+                return Error
+
+            # Checksum that computed while storing save
+            # a read of the whole file.
+            digest = self.checksumOf(ident)
+            if digest is None:
+                digest = fileDigest(path)
+
+            try:
+                self.__linkBlob(path, digest, ident)
+            except OSError:
+                traceback.print_exc()
+                return Error
+
+        return Ok
+
+    def __blobPath(self, digest:str) -> str:
+        return pathStrConcate(self.__path, Storage.BLOB_DIR, digest,
+                              seperator = seperator)
+
+    # Make path a hardlink of blob of digest, content of path
+    # become the blob if the blob is not exists.
+    def __linkBlob(self, path:str, digest:str, ident:str) -> None:
+        blob = self.__blobPath(digest)
+
+        with self.__blobLock:
+            if os.path.exists(blob):
+                tmp = path + ".link"
+                os.link(blob, tmp)
+                os.replace(tmp, path)
+            else:
+                os.link(path, blob)
+                # Blob is shared by idents
+                os.chmod(blob, 0o444)
+
+            self.__refs[digest] = self.__refs.get(digest, 0) + 1
+
+        self.__record(ident, path, digest)
+
+    # Drop reference of ident to it's blob, the blob is
+    # removed if it's not referenced by any ident.
+    def __unseal(self, ident:str) -> None:
+        digest = self.digestOf(ident)
+
+        if digest is None:
+            return None
+
+        with self.__blobLock:
+            self.__refs[digest] -= 1
+
+            if self.__refs[digest] == 0:
+                del self.__refs [digest]
+
+                try:
+                    os.remove(self.__blobPath(digest))
+                except FileNotFoundError:
+                    pass
+
+    def isExists(self, ident:str) -> bool:
+        return ident in self.__crago or self.__isSegmented(ident)
+
+    def numOfFiles(self) -> int:
+        if self.__segments is None:
+            return len(self.__crago)
+
+        return len(self.__crago) + len(self.__segments.idents())
+
+    def getPath(self, ident:str) -> typing.Optional[str]:
+        return self.__crago.get(ident, "")
+
+    # User should make sure filePath is within Storage's path
+    def __addNewFile(self, ident, filePath:str) -> State:
+        if ident in self.__crago:
+            return Error
+
+        self.__crago[ident] = filePath
+
+        if self.digestOf(ident) is None:
+            self.__record(ident, filePath)
+
+        return Ok
+
+    def copy(self, filePath:str) -> State:
+        return self.__copyIn(filePath)
+
+    # Copy files into Storage by copy workers, ident
+    # of a file is it's name without extension.
+    def copyMany(self, filePaths:typing.List[str]) -> typing.List[StoCopyTask]:
+        tasks = []
+
+        for filePath in filePaths:
+            ident = Storage.__trimExtension(os.path.basename(filePath.rstrip(seperator)))
+
+            try:
+                total = treeSize(filePath)
+            except OSError:
+                total = 0
+
+            task = StoCopyTask(ident, total)
+            task.future = self.__submit(self.__copyIn, filePath, task.update)
+            tasks.append(task)
+
+        return tasks
+
+    def copyManyTo(self, items:typing.List[typing.Tuple[str, str]]) -> typing.List[StoCopyTask]:
+        tasks = []
+
+        for (ident, dest) in items:
+            path = self.__crago.get(ident, None)
+
+            try:
+                total = 0 if path is None else treeSize(path)
+            except OSError:
+                total = 0
+
+            task = StoCopyTask(ident, total)
+            task.future = self.__submit(self.__copyOut, ident, dest, task.update)
+            tasks.append(task)
+
+        return tasks
+
+    def __submit(self, f:typing.Callable, *args) -> Future:
+        with self.__copyLock:
+            if self.__copyExecutor is None:
+                self.__copyExecutor = ThreadPoolExecutor(
+                    max_workers = self.__copyWorkers, thread_name_prefix = "StoCopy")
+
+        return self.__copyExecutor.submit(f, *args)
+
+    @staticmethod
+    def __copyFileWith(progress:typing.Optional[typing.Callable[[int], None]]) \
+        -> typing.Callable[[str, str], None]:
+
+        def copy(src:str, dst:str) -> None:
+            if os.path.isdir(dst):
+                dst = os.path.join(dst, os.path.basename(src))
+
+            copyFile(src, dst, progress)
+            shutil.copymode(src, dst)
+
+        return copy
+
+    def __copyIn(self, filePath:str,
+                 progress:typing.Optional[typing.Callable[[int], None]] = None) -> State:
+
+        if len(filePath) < 1:
+            return Error
+
+        isDir = os.path.isdir(filePath)
+        if not isDir and not os.path.isfile(filePath):
+            return Error
+
+        targetFile = os.path.basename(filePath.rstrip(seperator))
+        stoIdent = Storage.__trimExtension(targetFile)
+
+        dest = self.__path + seperator + targetFile
+        copy = Storage.__copyFileWith(progress)
+
+        with self.__lockOf(stoIdent):
+            if stoIdent in self.__crago:
+                return Error
+
+            if self.__dedup and not isDir:
+                return self.__copyDedup(filePath, dest, stoIdent, copy)
+
+            try:
+                if isDir:
+                    shutil.copytree(filePath, dest, copy_function = copy)
+                else:
+                    copy(filePath, dest)
+            except OSError:
+                traceback.print_exc()
+                return Error
+
+            self.__addNewFile(stoIdent, dest)
+
+        self.__enforce()
+
+        return Ok
+
+    # Copy a file into Storage, a file that has the same content
+    # with a blob is linked to the blob instead of copied.
+    def __copyDedup(self, filePath:str, dest:str, stoIdent:str,
+                    copy:typing.Callable[[str, str], None]) -> State:
+        try:
+            digest = fileDigest(filePath)
+
+            if not os.path.exists(self.__blobPath(digest)):
+                copy(filePath, dest)
+
+            self.__linkBlob(dest, digest, stoIdent)
+        except OSError:
+            traceback.print_exc()
+            return Error
+
+        self.__addNewFile(stoIdent, dest)
+
+        return Ok
+
+    def copyTo(self, ident:str, dest:str) -> State:
+        return self.__copyOut(ident, dest)
+
+    def __copyOut(self, ident:str, dest:str,
+                  progress:typing.Optional[typing.Callable[[int], None]] = None) -> State:
+
+        if dest == "":
+            return Error
+
+        if self.__isSegmented(ident):
+            return self.__copySegmentOut(ident, dest, progress)
+
+        path = self.__crago.get(ident, None)
+        if path is None:
+            return Error
+
+        self.__touch(ident)
+
+        # Sealed content is immutable, link it if possible.
+        if self.isSealed(ident):
+            if os.path.isdir(dest):
+                dest = pathStrConcate(dest, os.path.basename(path),
+                                      seperator = seperator)
+
+            if os.path.exists(dest) and os.path.samefile(path, dest):
+                return Ok
+
+            try:
+                if os.path.exists(dest):
+                    os.remove(dest)
+                os.link(path, dest)
+            except OSError:
+                # Cross devices, fallback to copy without
+                # mode bits of the blob.
+                try:
+                    copyFile(path, dest, progress)
+                except OSError:
+                    traceback.print_exc()
+                    return Error
+
+            return Ok
+
+        try:
+            Storage.__copyFileWith(progress)(path, dest)
+        except OSError:
+            traceback.print_exc()
+            return Error
+
+        return Ok
+
+    # Content of segmented ident is written into dest,
+    # name of the file is the ident.
+    def __copySegmentOut(self, ident:str, dest:str,
+                         progress:typing.Optional[typing.Callable[[int], None]] = None) -> State:
+
+        if os.path.isdir(dest):
+            dest = pathStrConcate(dest, ident, seperator = seperator)
+
+        chooser = self.__segments.open(ident) # type: ignore
+        chooser.rewind()
+
+        try:
+            with open(dest, "wb") as f:
+                while True:
+                    content = chooser.retrive(COPY_CHUNK)
+                    if len(content) == 0:
+                        break
+
+                    f.write(content)
+                    if progress is not None:
+                        progress(len(content))
+        except OSError:
             traceback.print_exc()
             return Error
 
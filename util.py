@@ -1,12 +1,17 @@
 # util.py
 
 from typing import Any, Callable
-from threading import Thread
+from threading import Thread, Lock, BoundedSemaphore
+from queue import Queue
+from concurrent.futures import Future, ProcessPoolExecutor
 
 from functools import reduce
 
 from typing import *
 
+import os
+import time
+
 def spawnThread(f:Callable[[Any], None], args: Any = None) -> Thread:
 
     class AnonyThread(Thread):
@@ -21,6 +26,231 @@ def spawnThread(f:Callable[[Any], None], args: Any = None) -> Thread:
 
     return anony
 
+# Handle of a task that run by an Executor, it can be
+# used in places where the Thread of spawnThread is used.
+class Task:
+
+    def __init__(self, future:Future) -> None:
+        self.future = future
+
+    def join(self, timeout:Optional[float] = None) -> None:
+        try:
+            self.future.exception(timeout = timeout)
+        except Exception:
+            pass
+
+    def is_alive(self) -> bool:
+        return not self.future.done()
+
+    def result(self, timeout:Optional[float] = None) -> Any:
+        return self.future.result(timeout = timeout)
+
+class Executor:
+
+    # Worker threads are started on demand up to workers,
+    # submitter is blocked while maxQueue tasks are waiting.
+    def __init__(self, workers:int = 8, maxQueue:int = 1024,
+                 processes:int = 0) -> None:
+
+        self.__workers = max(1, workers)
+        self.__threads = [] # type: List[Thread]
+        self.__queue = Queue(maxsize = maxQueue) # type: Queue
+        self.__lock = Lock()
+        self.__isShutdown = False
+
+        # Process pool is for CPU bound tasks, tasks and
+        # their arguments must be picklable.
+        self.__processes = processes
+        self.__procPool = None # type: Optional[ProcessPoolExecutor]
+        self.__procSlots = BoundedSemaphore(maxQueue + max(1, processes))
+
+        # Tasks that are put but not taken by workers
+        self.__pending = 0
+        self.__idle = 0
+        self.__running = 0
+        self.__submitted = 0
+        self.__completed = 0
+        self.__failed = 0
+        self.__maxQueued = 0
+        self.__waitUs = 0
+        self.__maxWaitUs = 0
+        self.__runUs = 0
+        self.__maxRunUs = 0
+
+    def submit(self, f:Callable, *args, **kwargs) -> Future:
+        future = Future() # type: Future
+
+        with self.__lock:
+            if self.__isShutdown:
+                raise RuntimeError("submit after shutdown")
+
+            self.__submitted += 1
+            self.__pending += 1
+
+            if self.__pending > self.__idle and len(self.__threads) < self.__workers:
+                self.__spawnWorker()
+
+        self.__queue.put((future, f, args, kwargs, time.monotonic()))
+
+        depth = self.__queue.qsize()
+        if depth > self.__maxQueued:
+            self.__maxQueued = depth
+
+        return future
+
+    # Run f in the process pool, fallback to threads
+    # if no processes are configured.
+    def submitCPU(self, f:Callable, *args, **kwargs) -> Future:
+        if self.__processes <= 0:
+            return self.submit(f, *args, **kwargs)
+
+        self.__procSlots.acquire()
+
+        with self.__lock:
+            if self.__isShutdown:
+                self.__procSlots.release()
+                raise RuntimeError("submit after shutdown")
+
+            if self.__procPool is None:
+                self.__procPool = ProcessPoolExecutor(max_workers = self.__processes)
+
+            self.__submitted += 1
+            self.__running += 1
+
+        begin = time.monotonic()
+        future = self.__procPool.submit(f, *args, **kwargs)
+
+        def done(future:Future) -> None:
+            self.__procSlots.release()
+            self.__finish(begin, begin, future.cancelled() or
+                          future.exception() is not None)
+
+        future.add_done_callback(done)
+
+        return future
+
+    def spawn(self, f:Callable[[Any], None], args: Any = None) -> Task:
+        if args is None:
+            return Task(self.submit(f))
+
+        return Task(self.submit(f, args))
+
+    def shutdown(self, wait:bool = True) -> None:
+        with self.__lock:
+            if self.__isShutdown:
+                return None
+
+            self.__isShutdown = True
+            threads = list(self.__threads)
+
+        for t in threads:
+            self.__queue.put(None)
+
+        if wait:
+            for t in threads:
+                t.join()
+
+        if self.__procPool is not None:
+            self.__procPool.shutdown(wait = wait)
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            finished = max(1, self.__completed + self.__failed)
+
+            return {
+                "workers": len(self.__threads),
+                "queued": self.__queue.qsize(),
+                "maxQueued": self.__maxQueued,
+                "running": self.__running,
+                "submitted": self.__submitted,
+                "completed": self.__completed,
+                "failed": self.__failed,
+                "avgWaitUs": self.__waitUs // finished,
+                "maxWaitUs": self.__maxWaitUs,
+                "avgRunUs": self.__runUs // finished,
+                "maxRunUs": self.__maxRunUs
+            }
+
+    def __spawnWorker(self) -> None:
+        t = Thread(target = self.__work, daemon = True,
+                   name = "Executor-%d" % len(self.__threads))
+        self.__threads.append(t)
+        t.start()
+
+    def __work(self) -> None:
+        queue = self.__queue
+
+        while True:
+            with self.__lock:
+                self.__idle += 1
+
+            item = queue.get()
+
+            with self.__lock:
+                self.__idle -= 1
+                if item is not None:
+                    self.__pending -= 1
+
+            if item is None:
+                return None
+
+            (future, f, args, kwargs, enqueued) = item
+
+            if not future.set_running_or_notify_cancel():
+                self.__finish(enqueued, time.monotonic(), True, False)
+                continue
+
+            begin = time.monotonic()
+            with self.__lock:
+                self.__running += 1
+
+            try:
+                result = f(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                self.__finish(enqueued, begin, True)
+            else:
+                future.set_result(result)
+                self.__finish(enqueued, begin, False)
+
+    def __finish(self, enqueued:float, begin:float, failed:bool,
+                 running:bool = True) -> None:
+
+        end = time.monotonic()
+        waitUs = int((begin - enqueued) * 1000000)
+        runUs = int((end - begin) * 1000000)
+
+        with self.__lock:
+            if running:
+                self.__running -= 1
+
+            if failed:
+                self.__failed += 1
+            else:
+                self.__completed += 1
+
+            self.__waitUs += waitUs
+            self.__runUs += runUs
+            self.__maxWaitUs = max(self.__maxWaitUs, waitUs)
+            self.__maxRunUs = max(self.__maxRunUs, runUs)
+
+executor = None # type: Optional[Executor]
+executorLock = Lock()
+
+def defaultExecutor() -> Executor:
+    global executor
+
+    with executorLock:
+        if executor is None:
+            executor = Executor(workers = min(32, (os.cpu_count() or 1) + 4))
+
+        return executor
+
+# Like spawnThread but f is run by a worker of the default
+# Executor, long running loops should still use spawnThread.
+def spawnTask(f:Callable[[Any], None], args: Any = None) -> Task:
+    return defaultExecutor().spawn(f, args)
+
 def pathStrConcate(*args, seperator:str) -> str:
     argsL = list(args)
 